@@ -0,0 +1,110 @@
+import math
+import time
+import asyncio
+from collections import deque
+
+
+class Overloaded(Exception):
+    """Raised by AdmissionController.acquire when the wait queue is full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server is busy, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Caps the total estimated cost of the requests running at once.
+
+    Requests that do not fit wait in a FIFO queue of at most max_queue
+    entries; past that, acquire() raises Overloaded with a Retry-After
+    estimate of how long the work ahead takes to drain at the throughput
+    (cost finished per second) seen over the last window seconds. A
+    request costing more than max_cost on its own is still admitted once
+    nothing else runs. Meant to be used from a single event loop.
+    """
+
+    def __init__(self, max_cost, max_queue, window=60, default_retry_after=10, max_retry_after=300):
+        self.max_cost = max_cost
+        self.max_queue = max_queue
+        self.window = window
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self.in_flight_cost = 0
+        self._waiters = deque()
+        self._finished = deque()
+        self._started = time.monotonic()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    @property
+    def queued_cost(self):
+        return sum(cost for cost, _ in self._waiters)
+
+    def _fits(self, cost):
+        return self.in_flight_cost == 0 or self.in_flight_cost + cost <= self.max_cost
+
+    def throughput(self):
+        """Cost finished per second over the last window, or None before anything finished."""
+        now = time.monotonic()
+        while self._finished and self._finished[0][0] < now - self.window:
+            self._finished.popleft()
+        if not self._finished:
+            return None
+        span = min(self.window, now - self._started)
+        return sum(cost for _, cost in self._finished) / max(span, 1)
+
+    def retry_after(self, cost=0):
+        rate = self.throughput()
+        if not rate:
+            return self.default_retry_after
+        backlog = self.in_flight_cost + self.queued_cost + cost - self.max_cost
+        seconds = math.ceil(max(backlog, cost) / rate)
+        return min(max(seconds, 1), self.max_retry_after)
+
+    def check(self, cost):
+        """
+        Raise Overloaded if acquire(cost) would right now, so a request can
+        be turned away before any work (such as reading its body) is done.
+        """
+        if (self._waiters or not self._fits(cost)) and len(self._waiters) >= self.max_queue:
+            raise Overloaded(self.retry_after(cost))
+
+    async def acquire(self, cost):
+        if not self._waiters and self._fits(cost):
+            self.in_flight_cost += cost
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded(self.retry_after(cost))
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (cost, future)
+        self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admitted just as the caller gave up
+                self.release(cost, finished=False)
+            else:
+                self._waiters.remove(waiter)
+                self._wake()
+            raise
+
+    def release(self, cost, finished=True):
+        self.in_flight_cost -= cost
+        if finished:
+            self._finished.append((time.monotonic(), cost))
+        self._wake()
+
+    def _wake(self):
+        # Strict FIFO, so a large request is not starved by smaller ones
+        while self._waiters and self._fits(self._waiters[0][0]):
+            cost, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight_cost += cost
+            future.set_result(None)
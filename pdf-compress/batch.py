@@ -0,0 +1,323 @@
+# Batch-mode plumbing shared by dummy.py and demo.py: sizing the pool,
+# claiming output names, the manifest of finished inputs and the pool that
+# runs a CLI's compress function over a batch
+
+import os
+import re
+import json
+import math
+import sqlite3
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from datetime import datetime
+
+
+def format_size(size_bytes):
+    if size_bytes < 1024:
+        return f"{size_bytes} B"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.2f} KB"
+    else:
+        return f"{size_bytes / (1024 * 1024):.2f} MB"
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    elif seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    else:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
+
+def available_cpus():
+    """CPUs this process may use: its affinity mask, capped by any cgroup CPU quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" or "max <period>"
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            limit, period = f.read().split()
+        if limit != "max":
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: a quota of -1 means unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                limit = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if limit > 0:
+                quota = limit / period
+        except (OSError, ValueError):
+            pass
+
+    if quota:
+        cpus = min(cpus, math.ceil(quota))
+    return max(cpus, 1)
+
+
+# Next _N suffix to try per (folder, stem, extension), seeded from one
+# listing of each folder. A stem that merely ends in digits (scan_20240115)
+# also lands here, so this is only a hint for where to start probing once
+# the bare name is known to be taken.
+_next_suffix = {}
+_indexed_folders = set()
+
+
+def _index_folder(parent):
+    for entry in os.scandir(parent):
+        stem, suffix = os.path.splitext(entry.name)
+        match = re.fullmatch(r"(.+)_(\d+)", stem)
+        if match:
+            key = (str(parent), match.group(1), suffix)
+            _next_suffix[key] = max(_next_suffix.get(key, 1), int(match.group(2)) + 1)
+
+    _indexed_folders.add(str(parent))
+
+
+def _claim(path, reserved):
+    if reserved is not None and path in reserved:
+        return False
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    if reserved is not None:
+        reserved.add(path)
+    return True
+
+
+def get_non_overwriting_path(path: Path, reserved=None) -> Path:
+    """
+    Claim a free output name: path itself, or path with _1, _2, _3...
+    before the file extension. The name is claimed by creating it empty
+    with O_CREAT|O_EXCL, so parallel workers or separate runs can never
+    get the same one. Once the bare name is taken, probing starts past
+    the highest suffix seen for the stem, so a folder full of earlier
+    runs costs a single listing instead of a stat per existing copy.
+    Paths in reserved are skipped too.
+    """
+    if _claim(path, reserved):
+        return path
+
+    parent = path.parent
+    if str(parent) not in _indexed_folders:
+        _index_folder(parent)
+
+    key = (str(parent), path.stem, path.suffix)
+    counter = _next_suffix.get(key, 1)
+
+    while True:
+        new_path = parent / f"{path.stem}_{counter}{path.suffix}"
+        counter += 1
+        if _claim(new_path, reserved):
+            _next_suffix[key] = counter
+            return new_path
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_db(output_folder, name):
+    """
+    Open the manifest name inside output_folder. Batch runs record every
+    input there so a re-run only compresses new or changed files.
+    """
+    conn = sqlite3.connect(Path(output_folder) / name, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS files (
+            input_path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            sha256 TEXT,
+            settings TEXT NOT NULL,
+            output_path TEXT NOT NULL,
+            status TEXT NOT NULL,
+            original_size INTEGER,
+            compressed_size INTEGER,
+            fits INTEGER,
+            error TEXT,
+            updated_at TEXT NOT NULL
+        )
+        """
+    )
+    # demo.py used to share dummy.py's manifest and created it without this column
+    columns = [row["name"] for row in conn.execute("PRAGMA table_info(files)")]
+    if "fits" not in columns:
+        conn.execute("ALTER TABLE files ADD COLUMN fits INTEGER")
+    return conn
+
+
+def claimed_outputs(output_folder, names):
+    """
+    Output paths recorded in the manifests names inside output_folder,
+    i.e. names the other CLIs writing to the same folder have claimed.
+    """
+    claimed = set()
+    for name in names:
+        path = Path(output_folder) / name
+        if not path.exists():
+            continue
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+            try:
+                claimed.update(Path(row[0]) for row in conn.execute("SELECT output_path FROM files"))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+    return claimed
+
+
+def plan_batch(conn, pdf_files, output_folder, settings, force=False, claimed=()):
+    """
+    Return (tasks, unchanged) for pdf_files against the manifest.
+
+    A file is unchanged if its last run finished with the same settings,
+    its output still exists, and its size and mtime (or, failing that,
+    its content hash) still match. Every other file is queued in the
+    manifest under the output path it had before, if any, so a modified
+    input replaces its old output and an interrupted run resumes into
+    the same names instead of creating _1, _2... New inputs, and inputs
+    whose old output is in claimed (see claimed_outputs), get a fresh
+    compressed_<name> output.
+    """
+    settings_json = json.dumps(settings, sort_keys=True)
+    claimed = set(claimed)
+    reserved = {Path(row["output_path"]) for row in conn.execute("SELECT output_path FROM files")} | claimed
+    now = datetime.now().isoformat()
+
+    tasks = []
+    unchanged = []
+    for pdf_file in pdf_files:
+        try:
+            stat = pdf_file.stat()
+        except FileNotFoundError:
+            continue
+        row = conn.execute("SELECT * FROM files WHERE input_path = ?", (str(pdf_file),)).fetchone()
+
+        if (
+            row is not None
+            and not force
+            and row["status"] == "done"
+            and row["settings"] == settings_json
+            and Path(row["output_path"]).exists()
+            and Path(row["output_path"]) not in claimed
+            and row["size"] == stat.st_size
+        ):
+            if row["mtime_ns"] == stat.st_mtime_ns:
+                unchanged.append(pdf_file)
+                continue
+            # Touched or copied over with the same bytes
+            if row["sha256"] == file_sha256(pdf_file):
+                conn.execute(
+                    "UPDATE files SET mtime_ns = ?, updated_at = ? WHERE input_path = ?",
+                    (stat.st_mtime_ns, now, str(pdf_file))
+                )
+                unchanged.append(pdf_file)
+                continue
+
+        if row is not None and Path(row["output_path"]) not in claimed:
+            output_file = Path(row["output_path"])
+        else:
+            base_output_file = output_folder / f"compressed_{pdf_file.name}"
+            output_file = get_non_overwriting_path(base_output_file, reserved)
+
+        conn.execute(
+            "INSERT OR REPLACE INTO files "
+            "(input_path, size, mtime_ns, sha256, settings, output_path, status, updated_at) "
+            "VALUES (?, ?, ?, NULL, ?, ?, 'queued', ?)",
+            (str(pdf_file), stat.st_size, stat.st_mtime_ns, settings_json, str(output_file), now)
+        )
+        tasks.append((pdf_file, output_file))
+
+    conn.commit()
+    return tasks, unchanged
+
+
+def record_result(conn, pdf_file, result):
+    now = datetime.now().isoformat()
+    if isinstance(result, Exception):
+        conn.execute(
+            "UPDATE files SET status = 'failed', error = ?, updated_at = ? WHERE input_path = ?",
+            (str(result), now, str(pdf_file))
+        )
+    else:
+        original_size, compressed_size, fits, sha256 = result
+        conn.execute(
+            "UPDATE files SET status = 'done', sha256 = ?, original_size = ?, compressed_size = ?, "
+            "fits = ?, error = NULL, updated_at = ? WHERE input_path = ?",
+            (sha256, original_size, compressed_size, fits, now, str(pdf_file))
+        )
+    conn.commit()
+
+
+def remove_placeholder(output_path):
+    """Remove the empty file get_non_overwriting_path claimed, if nothing was written to it."""
+    try:
+        if os.path.getsize(output_path) == 0:
+            os.remove(output_path)
+    except OSError:
+        pass
+
+
+def run_file_job(compress, input_path, output_path):
+    """
+    Run compress(input_path, output_path), which returns (original_size,
+    compressed_size, fits), and add the input's hash for the manifest.
+    """
+    sha256 = file_sha256(input_path)
+    try:
+        original_size, compressed_size, fits = compress(input_path, output_path)
+    except Exception:
+        remove_placeholder(output_path)
+        raise
+    return original_size, compressed_size, fits, sha256
+
+
+def run_batch(tasks, compress, jobs=1):
+    """
+    Compress (pdf_file, output_file) pairs with compress (see run_file_job;
+    it must be picklable), jobs files at a time, and yield
+    (pdf_file, output_file, result) in completion order. result is
+    (original_size, compressed_size, fits, sha256) or the exception raised.
+    """
+    if jobs <= 1:
+        for pdf_file, output_file in tasks:
+            try:
+                yield pdf_file, output_file, run_file_job(compress, str(pdf_file), str(output_file))
+            except Exception as e:
+                yield pdf_file, output_file, e
+        return
+
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    try:
+        futures = {
+            pool.submit(run_file_job, compress, str(pdf_file), str(output_file)): (pdf_file, output_file)
+            for pdf_file, output_file in tasks
+        }
+        for future in as_completed(futures):
+            pdf_file, output_file = futures[future]
+            try:
+                yield pdf_file, output_file, future.result()
+            except Exception as e:
+                yield pdf_file, output_file, e
+    finally:
+        # Also reached on Ctrl-C: drop the queued files, let running ones finish
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,260 @@
+# benchmark the compression strategies in fapi.py and dummy.py
+
+import os
+import csv
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import importlib
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+
+# (module, function, extra kwargs) for every strategy that gets benchmarked
+STRATEGIES = {
+    "fapi.ghostscript_ebook": ("fapi", "compress_with_ghostscript", {"setting": "ebook"}),
+    "fapi.ghostscript_screen": ("fapi", "compress_with_ghostscript_aggressive", {}),
+    "fapi.pikepdf": ("fapi", "compress_with_pikepdf", {"quality": 45, "max_dimension": 700}),
+    "fapi.compress_pdf": ("fapi", "compress_pdf", {}),
+    "dummy.ghostscript_ebook": ("dummy", "compress_with_ghostscript", {"setting": "ebook"}),
+    "dummy.ghostscript_screen": ("dummy", "compress_with_ghostscript_aggressive", {}),
+    "dummy.pikepdf": ("dummy", "compress_with_pikepdf", {"quality": 45, "max_dimension": 700}),
+    "dummy.compress_pdf": ("dummy", "compress_pdf", {}),
+}
+
+# Metrics compared between reports; for all of them lower is better
+METRICS = ["wall_time", "cpu_time", "peak_rss_kb", "children_peak_rss_kb", "output_size"]
+
+
+def run_one(strategy, input_path):
+    """
+    Run a single strategy once in this (fresh) interpreter and print its
+    measurements as JSON. Called by run_strategy through a subprocess so
+    that peak RSS is per run.
+    """
+    module_name, function_name, kwargs = STRATEGIES[strategy]
+    module = importlib.import_module(module_name)
+    func = getattr(module, function_name)
+
+    temp_dir = tempfile.mkdtemp()
+    output_path = os.path.join(temp_dir, "output.pdf")
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+
+    result = func(input_path, output_path, **kwargs)
+
+    wall_time = time.perf_counter() - start
+
+    # Persistent gs interpreters only show up in RUSAGE_CHILDREN once reaped
+    if hasattr(module, "shutdown_executor"):
+        module.shutdown_executor()
+
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = (
+        (self_after.ru_utime - self_before.ru_utime)
+        + (self_after.ru_stime - self_before.ru_stime)
+        + (children_after.ru_utime - children_before.ru_utime)
+        + (children_after.ru_stime - children_before.ru_stime)
+    )
+
+    ok = result is not False and os.path.exists(output_path)
+    output_size = os.path.getsize(output_path) if ok else None
+
+    print(json.dumps({
+        "ok": ok,
+        "wall_time": wall_time,
+        "cpu_time": cpu_time,
+        "peak_rss_kb": self_after.ru_maxrss,
+        "children_peak_rss_kb": children_after.ru_maxrss,
+        "output_size": output_size,
+    }))
+
+    try:
+        os.remove(output_path)
+        os.rmdir(temp_dir)
+    except OSError:
+        pass
+
+
+def run_strategy(strategy, input_path):
+    here = os.path.dirname(os.path.abspath(__file__))
+    # Every run must do the full work, so fapi's persistent caches are off
+    env = dict(os.environ, PDF_COMPRESS_RESULT_CACHE="0", PDF_COMPRESS_NEGATIVE_CACHE="0")
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "run-one", strategy, str(input_path)],
+        capture_output=True,
+        text=True,
+        cwd=here,
+        env=env
+    )
+
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"ok": False, "error": result.stderr.strip().splitlines()[-1:] or ["no output"]}
+    return json.loads(lines[-1])
+
+
+def summarize(records):
+    """Median of every metric per (file, strategy) over the successful runs."""
+    groups = {}
+    for record in records:
+        if record.get("ok"):
+            groups.setdefault((record["file"], record["strategy"]), []).append(record)
+
+    summary = []
+    for (file_name, strategy), runs in sorted(groups.items()):
+        row = {"file": file_name, "strategy": strategy, "runs": len(runs)}
+        for metric in METRICS:
+            row[metric] = statistics.median(run[metric] for run in runs)
+        row["input_size"] = runs[0]["input_size"]
+        row["reduction"] = 1 - row["output_size"] / row["input_size"] if row["input_size"] else 0
+        summary.append(row)
+
+    return summary
+
+
+def run_benchmark(corpus, strategies, repeat, output):
+    pdf_files = sorted(Path(corpus).glob("*.pdf"))
+    if not pdf_files:
+        print(f"No PDF files found in '{corpus}' folder.")
+        return 1
+
+    print(f"Benchmarking {len(strategies)} strategies on {len(pdf_files)} file(s), {repeat} run(s) each")
+    print("=" * 60)
+
+    records = []
+    for pdf_file in pdf_files:
+        input_size = os.path.getsize(pdf_file)
+        print(f"\n{pdf_file.name}")
+
+        for strategy in strategies:
+            for run in range(repeat):
+                measurement = run_strategy(strategy, pdf_file.resolve())
+                measurement.update({
+                    "file": pdf_file.name,
+                    "strategy": strategy,
+                    "run": run,
+                    "input_size": input_size,
+                })
+                records.append(measurement)
+
+                if measurement["ok"]:
+                    print(
+                        f"  {strategy:<26} run {run + 1}: "
+                        f"{measurement['wall_time']:.2f}s wall, "
+                        f"{measurement['cpu_time']:.2f}s cpu, "
+                        f"{measurement['output_size']} B"
+                    )
+                else:
+                    print(f"  {strategy:<26} run {run + 1}: failed {measurement.get('error', '')}")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "corpus": str(corpus),
+        "repeat": repeat,
+        "records": records,
+        "summary": summarize(records),
+    }
+
+    output = Path(output)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    csv_path = output.with_suffix(".csv")
+    with open(csv_path, "w", newline="") as f:
+        fields = ["file", "strategy", "runs", "input_size", *METRICS, "reduction"]
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(report["summary"])
+
+    print("\n" + "=" * 60)
+    print(f"Report saved to '{output}' and '{csv_path}'")
+    return 0
+
+
+def compare_reports(baseline_path, candidate_path, threshold):
+    """
+    Print how every metric moved between two reports and return 1 if any
+    got worse by more than threshold (a fraction, e.g. 0.1 for 10%).
+    """
+    with open(baseline_path) as f:
+        baseline = {(row["file"], row["strategy"]): row for row in json.load(f)["summary"]}
+    with open(candidate_path) as f:
+        candidate = {(row["file"], row["strategy"]): row for row in json.load(f)["summary"]}
+
+    regressions = 0
+    print(f"{'file':<28} {'strategy':<26} {'metric':<22} {'before':>12} {'after':>12} {'change':>8}")
+    print("=" * 112)
+
+    for key in sorted(baseline.keys() & candidate.keys()):
+        for metric in METRICS:
+            before = baseline[key][metric]
+            after = candidate[key][metric]
+            if not before:
+                continue
+
+            change = (after - before) / before
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+
+            print(
+                f"{key[0][:28]:<28} {key[1]:<26} {metric:<22} "
+                f"{before:>12.3f} {after:>12.3f} {change:>+7.1%}{flag}"
+            )
+
+    for key in sorted(baseline.keys() - candidate.keys()):
+        print(f"{key[0][:28]:<28} {key[1]:<26} missing from candidate report")
+        regressions += 1
+
+    print("=" * 112)
+    print(f"{regressions} regression(s) past {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PDF compression strategies")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="benchmark a corpus of PDFs")
+    run_parser.add_argument("corpus", nargs="?", default="data", help="folder of PDFs (default: data)")
+    run_parser.add_argument("--repeat", type=int, default=3, help="runs per strategy and file")
+    run_parser.add_argument(
+        "--strategy",
+        action="append",
+        choices=sorted(STRATEGIES),
+        help="strategy to run (repeatable, default: all)"
+    )
+    run_parser.add_argument("--output", default="bench_report.json", help="JSON report path; CSV goes next to it")
+
+    compare_parser = commands.add_parser("compare", help="diff two reports and flag regressions")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown/growth (default: 0.1)")
+
+    one_parser = commands.add_parser("run-one")
+    one_parser.add_argument("strategy", choices=sorted(STRATEGIES))
+    one_parser.add_argument("input_path")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        return run_benchmark(args.corpus, args.strategy or list(STRATEGIES), args.repeat, args.output)
+    if args.command == "compare":
+        return compare_reports(args.baseline, args.candidate, args.threshold)
+    run_one(args.strategy, args.input_path)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -233,38 +233,24 @@
 #     process_all_pdfs()
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
 # this code writed for adding counter for save logic and incresed 5 percentage compression to 30 percentage
 
 
-
-
-
-
 # pdf compressor tool
 
 import os
 import io
+import time
 import shutil
 import tempfile
+import argparse
 from PIL import Image
 import pikepdf
 from pathlib import Path
+from batch import (
+    format_size, format_duration, available_cpus, get_non_overwriting_path, manifest_db,
+    claimed_outputs, plan_batch, record_result, remove_placeholder, run_batch
+)
 
 
 def setup_folders():
@@ -281,6 +267,15 @@ def compress_image_data(image_bytes, quality=60, max_dimension=1000):
     try:
         img = Image.open(io.BytesIO(image_bytes))
         
+        # libjpeg can decode straight to 1/2, 1/4 or 1/8 scale; pick the
+        # smallest one that still covers max_dimension so oversized photos
+        # are never fully decoded
+        width, height = img.size
+        drafted = False
+        if img.format == 'JPEG' and (width > max_dimension or height > max_dimension):
+            ratio = min(max_dimension / width, max_dimension / height)
+            drafted = img.draft(img.mode, (int(width * ratio), int(height * ratio))) is not None
+        
         if img.mode in ('RGBA', 'LA'):
             background = Image.new('RGB', img.size, (255, 255, 255))
             if img.mode == 'RGBA':
@@ -293,11 +288,13 @@ def compress_image_data(image_bytes, quality=60, max_dimension=1000):
         elif img.mode not in ('RGB', 'L'):
             img = img.convert('RGB')
         
-        width, height = img.size
         if width > max_dimension or height > max_dimension:
             ratio = min(max_dimension / width, max_dimension / height)
             new_size = (int(width * ratio), int(height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
+            # After a draft decode at most a 2x reduction is left, which
+            # bicubic handles without visible loss
+            resample = Image.Resampling.BICUBIC if drafted else Image.Resampling.LANCZOS
+            img = img.resize(new_size, resample)
         
         output = io.BytesIO()
         img.save(output, format='JPEG', quality=quality, optimize=True)
@@ -401,54 +398,22 @@ def compress_pdf(input_path, output_path, quality=45, max_dimension=700):
             os.remove(temp_path)
 
 
-def format_size(size_bytes):
-    if size_bytes < 1024:
-        return f"{size_bytes} B"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.2f} KB"
-    else:
-        return f"{size_bytes / (1024 * 1024):.2f} MB"
-
-
-
-
-
-
-
-# for counter to save logics
-
-def get_non_overwriting_path(path: Path) -> Path:
-    """
-    If path exists, append _1, _2, _3... before the file extension
-    until a non-existing filename is found.
-    """
-    if not path.exists():
-        return path
-
-    stem = path.stem
-    suffix = path.suffix
-    parent = path.parent
-
-    counter = 1
-    while True:
-        new_path = parent / f"{stem}_{counter}{suffix}"
-        if not new_path.exists():
-            return new_path
-        counter += 1
-
-
-
-
-
-
-
-
-
+# Batch runs record every input here (inside the outputs folder) so a
+# re-run only compresses new or changed files. dummy.py writes to the same
+# folder with other settings, so each CLI keeps its own manifest and never
+# mistakes the other's outputs for its own; names dummy.py recorded in its
+# manifest are never handed out here.
+MANIFEST_NAME = "manifest-demo.db"
+OTHER_MANIFESTS = ("manifest.db",)
 
 
+def compress_file(input_path, output_path):
+    """Compress one batch file. Returns (original_size, compressed_size, None)."""
+    original_size, compressed_size = compress_pdf(input_path, output_path)
+    return original_size, compressed_size, None
 
 
-def process_all_pdfs():
+def process_all_pdfs(jobs=1, force=False):
     input_folder, output_folder = setup_folders()
     
     pdf_files = list(input_folder.glob("*.pdf"))
@@ -458,24 +423,39 @@ def process_all_pdfs():
         print(f"Please add PDF files to the '{input_folder}' folder and run again.")
         return
     
-    print(f"Found {len(pdf_files)} PDF file(s) to compress.\n")
+    # Output names are all picked here, in one process, so parallel
+    # workers can never be handed the same path
+    conn = manifest_db(output_folder, MANIFEST_NAME)
+    settings = {"quality": 45, "max_dimension": 700}
+    claimed = claimed_outputs(output_folder, OTHER_MANIFESTS)
+    tasks, unchanged = plan_batch(conn, pdf_files, output_folder, settings, force, claimed)
+    
+    print(f"Found {len(pdf_files)} PDF file(s), {len(unchanged)} unchanged since the last run.")
+    print(f"Compressing {len(tasks)} file(s), {jobs} at a time.\n")
     print("=" * 60)
     
+    input_sizes = {pdf_file: pdf_file.stat().st_size for pdf_file, _ in tasks}
+    total_input = sum(input_sizes.values())
+    
     total_original = 0
     total_compressed = 0
-    
-    for pdf_file in pdf_files:
-
-        # output_file = output_folder / f"compressed_{pdf_file.name}"
-
-        base_output_file = output_folder / f"compressed_{pdf_file.name}"
-        output_file = get_non_overwriting_path(base_output_file)
-
+    processed_bytes = 0
+    done = 0
+    failed = 0
+    start = time.monotonic()
+    
+    for pdf_file, output_file, result in run_batch(tasks, compress_file, jobs):
+        record_result(conn, pdf_file, result)
+        done += 1
+        processed_bytes += input_sizes[pdf_file]
         
-        print(f"\nProcessing: {pdf_file.name}")
+        print(f"\n[{done}/{len(tasks)}] {pdf_file.name}")
         
-        try:
-            original_size, compressed_size = compress_pdf(str(pdf_file), str(output_file))
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"  Error: {str(result)}")
+        else:
+            original_size, compressed_size, _, _ = result
             
             total_original += original_size
             total_compressed += compressed_size
@@ -490,18 +470,29 @@ def process_all_pdfs():
                 print(f"  Status: Already optimized (no reduction possible)")
             
             print(f"  Saved to:   {output_file}")
-            
-        except Exception as e:
-            print(f"  Error: {str(e)}")
+        
+        # ETA by bytes rather than files, since file sizes vary a lot
+        elapsed = time.monotonic() - start
+        rate = processed_bytes / elapsed if elapsed > 0 else 0
+        eta = (total_input - processed_bytes) / rate if rate > 0 else 0
+        print(
+            f"  Progress:   {done / elapsed if elapsed > 0 else 0:.2f} files/s, "
+            f"{format_size(rate)}/s, ETA {format_duration(eta)}"
+        )
+    
+    elapsed = time.monotonic() - start
+    conn.close()
     
     print("\n" + "=" * 60)
     print("SUMMARY")
     print("=" * 60)
+    print(f"Files compressed:      {done - failed} of {len(tasks)} ({failed} failed, {len(unchanged)} unchanged skipped)")
     print(f"Total original size:   {format_size(total_original)}")
     print(f"Total compressed size: {format_size(total_compressed)}")
     if total_original > 0 and total_compressed < total_original:
         total_reduction = ((total_original - total_compressed) / total_original) * 100
         print(f"Total reduction:       {total_reduction:.1f}%")
+    print(f"Elapsed time:          {format_duration(elapsed)}")
     print(f"\nCompressed files saved to '{output_folder}' folder.")
 
 
@@ -523,7 +514,11 @@ def compress_single_pdf(input_path, output_path=None):
 
     print(f"Compressing: {input_path}")
     
-    original_size, compressed_size = compress_pdf(input_path, output_path)
+    try:
+        original_size, compressed_size = compress_pdf(input_path, output_path)
+    except Exception:
+        remove_placeholder(output_path)
+        raise
     
     if compressed_size < original_size:
         reduction = ((original_size - compressed_size) / original_size) * 100
@@ -540,9 +535,23 @@ def compress_single_pdf(input_path, output_path=None):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress every PDF in the inputs folder")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=available_cpus(),
+        help="PDFs compressed in parallel (default: CPUs available to this process)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="recompress every input, even those unchanged since the last run"
+    )
+    args = parser.parse_args()
+    
     print("PDF Compressor Tool")
     print("=" * 60)
     print("This tool compresses PDF files (text and images)")
     print("=" * 60 + "\n")
     
-    process_all_pdfs()
+    process_all_pdfs(jobs=max(args.jobs, 1), force=args.force)
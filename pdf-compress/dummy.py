@@ -1,11 +1,24 @@
 import os
-import io
+import time
+import signal
 import shutil
 import tempfile
+import argparse
+import functools
 import subprocess
-from PIL import Image
-import pikepdf
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from datetime import datetime
+from images import compress_with_pikepdf, search_target_size
+from batch import (
+    format_size, format_duration, available_cpus, get_non_overwriting_path, manifest_db,
+    claimed_outputs, plan_batch, record_result, remove_placeholder, run_file_job, run_batch
+)
+from inotify import Inotify, IN_CLOSE_WRITE, IN_MOVED_TO, IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW
+
+
+# How often --watch mode checks on running compressions between inotify events
+POLL_INTERVAL = 0.5
 
 
 def setup_folders():
@@ -83,111 +96,7 @@ def compress_with_ghostscript_aggressive(input_path, output_path):
         return False
 
 
-def compress_image_data(image_bytes, quality=50, max_dimension=800):
-    try:
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        if img.mode in ('RGBA', 'LA'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'RGBA':
-                background.paste(img, mask=img.split()[3])
-            else:
-                background.paste(img, mask=img.split()[1])
-            img = background
-        elif img.mode == 'P':
-            img = img.convert('RGB')
-        elif img.mode not in ('RGB', 'L'):
-            img = img.convert('RGB')
-        
-        width, height = img.size
-        if width > max_dimension or height > max_dimension:
-            ratio = min(max_dimension / width, max_dimension / height)
-            new_size = (int(width * ratio), int(height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        
-        return output.getvalue(), img.size
-    except Exception:
-        return None, None
-
-
-def compress_with_pikepdf(input_path, output_path, quality=50, max_dimension=800):
-    """Compress using pikepdf with image recompression"""
-    try:
-        pdf = pikepdf.open(input_path)
-        images_processed = 0
-        
-        for page in pdf.pages:
-            if '/Resources' not in page:
-                continue
-            resources = page['/Resources']
-            if '/XObject' not in resources:
-                continue
-            
-            xobjects = resources['/XObject']
-            
-            for name in list(xobjects.keys()):
-                try:
-                    xobj = xobjects[name]
-                    if not isinstance(xobj, pikepdf.Stream):
-                        continue
-                    
-                    if xobj.get('/Subtype') != pikepdf.Name.Image:
-                        continue
-                    
-                    width = int(xobj.get('/Width', 0))
-                    height = int(xobj.get('/Height', 0))
-                    
-                    if width < 50 or height < 50:
-                        continue
-                    
-                    try:
-                        raw_size = len(xobj.read_raw_bytes())
-                        
-                        filter_type = xobj.get('/Filter')
-                        if filter_type == pikepdf.Name.DCTDecode:
-                            image_data = xobj.read_raw_bytes()
-                        else:
-                            image_data = xobj.read_bytes()
-                        
-                        compressed_data, new_size = compress_image_data(
-                            image_data, quality=quality, max_dimension=max_dimension
-                        )
-                        
-                        if compressed_data and len(compressed_data) < raw_size * 0.9:
-                            new_stream = pikepdf.Stream(pdf, compressed_data)
-                            new_stream['/Type'] = pikepdf.Name.XObject
-                            new_stream['/Subtype'] = pikepdf.Name.Image
-                            new_stream['/Width'] = new_size[0]
-                            new_stream['/Height'] = new_size[1]
-                            new_stream['/ColorSpace'] = pikepdf.Name.DeviceRGB
-                            new_stream['/BitsPerComponent'] = 8
-                            new_stream['/Filter'] = pikepdf.Name.DCTDecode
-                            
-                            xobjects[name] = new_stream
-                            images_processed += 1
-                            
-                    except Exception:
-                        continue
-                        
-                except Exception:
-                    continue
-        
-        pdf.save(
-            output_path,
-            compress_streams=True,
-            object_stream_mode=pikepdf.ObjectStreamMode.generate,
-            recompress_flate=True
-        )
-        pdf.close()
-        return True
-    except Exception:
-        return False
-
-
-def compress_pdf(input_path, output_path, target_reduction=0.25):
+def compress_pdf(input_path, output_path, target_reduction=0.25, workers=1, min_ssim=None):
     """
     Multi-stage compression:
     1. Try Ghostscript ebook quality first
@@ -213,7 +122,9 @@ def compress_pdf(input_path, output_path, target_reduction=0.25):
             size = os.path.getsize(temp_gs_screen)
             results.append(("ghostscript_screen", temp_gs_screen, size))
         
-        if compress_with_pikepdf(input_path, temp_pikepdf, quality=45, max_dimension=700):
+        if compress_with_pikepdf(
+            input_path, temp_pikepdf, quality=45, max_dimension=700, workers=workers, min_ssim=min_ssim
+        ):
             size = os.path.getsize(temp_pikepdf)
             results.append(("pikepdf", temp_pikepdf, size))
         
@@ -235,32 +146,59 @@ def compress_pdf(input_path, output_path, target_reduction=0.25):
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
-def format_size(size_bytes):
-    if size_bytes < 1024:
-        return f"{size_bytes} B"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.2f} KB"
-    else:
-        return f"{size_bytes / (1024 * 1024):.2f} MB"
+def compress_to_target(input_path, output_path, target_bytes, workers=1, min_ssim=None):
+    """
+    Compress input_path to at most target_bytes: the regular multi-stage
+    compression runs first and, if that is still too big, the image
+    settings are searched. Returns (original_size, compressed_size, fits).
+    """
+    original_size, compressed_size = compress_pdf(input_path, output_path, workers=workers, min_ssim=min_ssim)
+    
+    if compressed_size > target_bytes:
+        temp_dir = tempfile.mkdtemp()
+        temp_output = os.path.join(temp_dir, "target.pdf")
+        try:
+            size = search_target_size(input_path, temp_output, target_bytes, {}, workers=workers)
+            if size is not None and size < compressed_size:
+                shutil.copy2(temp_output, output_path)
+                compressed_size = size
+        except Exception:
+            pass
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    return original_size, compressed_size, compressed_size <= target_bytes
 
 
-def get_non_overwriting_path(path: Path) -> Path:
-    if not path.exists():
-        return path
+def compress_file(input_path, output_path, workers=1, target_bytes=None, min_ssim=None):
+    """
+    Compress one batch file, to target_bytes if given. Returns
+    (original_size, compressed_size, fits); fits is None without a target.
+    """
+    if target_bytes:
+        return compress_to_target(input_path, output_path, target_bytes, workers=workers, min_ssim=min_ssim)
+    original_size, compressed_size = compress_pdf(input_path, output_path, workers=workers, min_ssim=min_ssim)
+    return original_size, compressed_size, None
+
 
-    stem = path.stem
-    suffix = path.suffix
-    parent = path.parent
+def parse_size(text):
+    """Parse sizes like "2MB", "500KB" or "1048576" into bytes."""
+    text = text.strip().upper()
+    for unit, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024), ("B", 1)):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
 
-    counter = 1
-    while True:
-        new_path = parent / f"{stem}_{counter}{suffix}"
-        if not new_path.exists():
-            return new_path
-        counter += 1
 
+# Batch runs record every input here (inside the outputs folder) so a
+# re-run only compresses new or changed files. demo.py keeps its own
+# manifest in the same folder; names it recorded there are never handed
+# out here.
+MANIFEST_NAME = "manifest.db"
+OTHER_MANIFESTS = ("manifest-demo.db",)
 
-def process_all_pdfs():
+
+def process_all_pdfs(workers=1, target_bytes=None, min_ssim=None, jobs=1, force=False):
     input_folder, output_folder = setup_folders()
     
     pdf_files = list(input_folder.glob("*.pdf")) # + list(input_folder.glob("*.PDF"))
@@ -270,20 +208,40 @@ def process_all_pdfs():
         print(f"Please add PDF files to the '{input_folder}' folder and run again.")
         return
     
-    print(f"Found {len(pdf_files)} PDF file(s) to compress.\n")
+    # Output names are all picked here, in one process, so parallel
+    # workers can never be handed the same path
+    conn = manifest_db(output_folder, MANIFEST_NAME)
+    settings = {"target_bytes": target_bytes, "min_ssim": min_ssim}
+    claimed = claimed_outputs(output_folder, OTHER_MANIFESTS)
+    tasks, unchanged = plan_batch(conn, pdf_files, output_folder, settings, force, claimed)
+    
+    print(f"Found {len(pdf_files)} PDF file(s), {len(unchanged)} unchanged since the last run.")
+    print(f"Compressing {len(tasks)} file(s), {jobs} at a time.\n")
     print("=" * 60)
     
+    input_sizes = {pdf_file: pdf_file.stat().st_size for pdf_file, _ in tasks}
+    total_input = sum(input_sizes.values())
+    
     total_original = 0
     total_compressed = 0
+    processed_bytes = 0
+    done = 0
+    failed = 0
+    start = time.monotonic()
     
-    for pdf_file in pdf_files:
-        base_output_file = output_folder / f"compressed_{pdf_file.name}"
-        output_file = get_non_overwriting_path(base_output_file)
+    compress = functools.partial(compress_file, workers=workers, target_bytes=target_bytes, min_ssim=min_ssim)
+    for pdf_file, output_file, result in run_batch(tasks, compress, jobs):
+        record_result(conn, pdf_file, result)
+        done += 1
+        processed_bytes += input_sizes[pdf_file]
         
-        print(f"\nProcessing: {pdf_file.name}")
+        print(f"\n[{done}/{len(tasks)}] {pdf_file.name}")
         
-        try:
-            original_size, compressed_size = compress_pdf(str(pdf_file), str(output_file))
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"  Error: {str(result)}")
+        else:
+            original_size, compressed_size, fits, _ = result
             
             total_original += original_size
             total_compressed += compressed_size
@@ -297,23 +255,131 @@ def process_all_pdfs():
                 print(f"  Size: {format_size(original_size)}")
                 print(f"  Status: Already optimized (no reduction possible)")
             
-            print(f"  Saved to:   {output_file}")
+            if fits is not None:
+                if fits:
+                    print(f"  Target:     fits under {format_size(target_bytes)}")
+                else:
+                    print(f"  Target:     could not reach {format_size(target_bytes)}, kept the smallest result")
             
-        except Exception as e:
-            print(f"  Error: {str(e)}")
+            print(f"  Saved to:   {output_file}")
+        
+        # ETA by bytes rather than files, since file sizes vary a lot
+        elapsed = time.monotonic() - start
+        rate = processed_bytes / elapsed if elapsed > 0 else 0
+        eta = (total_input - processed_bytes) / rate if rate > 0 else 0
+        print(
+            f"  Progress:   {done / elapsed if elapsed > 0 else 0:.2f} files/s, "
+            f"{format_size(rate)}/s, ETA {format_duration(eta)}"
+        )
+    
+    elapsed = time.monotonic() - start
+    conn.close()
     
     print("\n" + "=" * 60)
     print("SUMMARY")
     print("=" * 60)
+    print(f"Files compressed:      {done - failed} of {len(tasks)} ({failed} failed, {len(unchanged)} unchanged skipped)")
     print(f"Total original size:   {format_size(total_original)}")
     print(f"Total compressed size: {format_size(total_compressed)}")
     if total_original > 0 and total_compressed < total_original:
         total_reduction = ((total_original - total_compressed) / total_original) * 100
         print(f"Total reduction:       {total_reduction:.1f}%")
+    print(f"Elapsed time:          {format_duration(elapsed)}")
     print(f"\nCompressed files saved to '{output_folder}' folder.")
 
 
-def compress_single_pdf(input_path, output_path=None):
+def watch_inputs(workers=1, target_bytes=None, min_ssim=None, jobs=1, backlog=None):
+    """
+    Compress PDFs as they land in the inputs folder, until interrupted.
+
+    A file is picked up once its writer closes it (IN_CLOSE_WRITE) or it
+    is renamed into the folder (IN_MOVED_TO), so half-written files are
+    never read. At most backlog files are handed to the pool at a time;
+    later arrivals wait in a pending list keyed by path, so a burst of
+    arrivals only costs a name each and repeated writes to the same file
+    are compressed once.
+    """
+    input_folder, output_folder = setup_folders()
+    backlog = backlog or jobs * 2
+    conn = manifest_db(output_folder, MANIFEST_NAME)
+    settings = {"target_bytes": target_bytes, "min_ssim": min_ssim}
+    compress = functools.partial(compress_file, workers=workers, target_bytes=target_bytes, min_ssim=min_ssim)
+    
+    watcher = Inotify()
+    watcher.add_watch(input_folder, IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF)
+    
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    
+    # Whatever arrived while the daemon was down; unchanged files are
+    # filtered out by the manifest
+    pending = dict.fromkeys(sorted(input_folder.glob("*.pdf")))
+    running = {}
+    pool = ProcessPoolExecutor(max_workers=jobs)
+    
+    print(f"Watching '{input_folder}' for new PDFs, {jobs} at a time. Press Ctrl-C to stop.")
+    
+    def finish(future):
+        pdf_file, output_file = running.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            result = e
+        record_result(conn, pdf_file, result)
+        
+        stamp = datetime.now().strftime("%H:%M:%S")
+        if isinstance(result, Exception):
+            print(f"[{stamp}] {pdf_file.name}: Error: {str(result)}")
+            return
+        
+        original_size, compressed_size, fits, _ = result
+        line = f"[{stamp}] {pdf_file.name}: {format_size(original_size)} -> {format_size(compressed_size)}"
+        if compressed_size < original_size:
+            line += f" ({(original_size - compressed_size) / original_size * 100:.1f}% smaller)"
+        if fits is False:
+            line += f", could not reach {format_size(target_bytes)}"
+        print(f"{line}, saved to {output_file}", flush=True)
+    
+    try:
+        while not stopping:
+            for future in [future for future in running if future.done()]:
+                finish(future)
+            
+            # Files being compressed stay pending if rewritten meanwhile,
+            # so one output is never written by two workers
+            busy = {pdf_file for pdf_file, _ in running.values()}
+            ready = [pdf_file for pdf_file in pending if pdf_file not in busy][:backlog - len(running)]
+            if ready:
+                for pdf_file in ready:
+                    del pending[pdf_file]
+                claimed = claimed_outputs(output_folder, OTHER_MANIFESTS)
+                tasks, _ = plan_batch(conn, ready, output_folder, settings, claimed=claimed)
+                for pdf_file, output_file in tasks:
+                    future = pool.submit(run_file_job, compress, str(pdf_file), str(output_file))
+                    running[future] = (pdf_file, output_file)
+            
+            for wd, mask, cookie, name in watcher.read(timeout=POLL_INTERVAL):
+                if mask & IN_Q_OVERFLOW:
+                    # The kernel dropped events; rescan and let the manifest sort it out
+                    pending.update(dict.fromkeys(sorted(input_folder.glob("*.pdf"))))
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    print(f"'{input_folder}' was removed, stopping.")
+                    stopping.append(mask)
+                elif name.endswith(".pdf") and not name.startswith("."):
+                    pending[input_folder / name] = None
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("Stopping: waiting for the files in progress...")
+        # Queued files are left 'queued' in the manifest and picked up on the next start
+        pool.shutdown(wait=True, cancel_futures=True)
+        for future in [future for future in running if future.done() and not future.cancelled()]:
+            finish(future)
+        watcher.close()
+        conn.close()
+
+
+def compress_single_pdf(input_path, output_path=None, workers=1, target_bytes=None, min_ssim=None):
     setup_folders()
     
     if output_path is None:
@@ -324,7 +390,13 @@ def compress_single_pdf(input_path, output_path=None):
     
     print(f"Compressing: {input_path}")
     
-    original_size, compressed_size = compress_pdf(input_path, output_path)
+    try:
+        original_size, compressed_size, fits = compress_file(
+            input_path, output_path, workers=workers, target_bytes=target_bytes, min_ssim=min_ssim
+        )
+    except Exception:
+        remove_placeholder(output_path)
+        raise
     
     if compressed_size < original_size:
         reduction = ((original_size - compressed_size) / original_size) * 100
@@ -335,18 +407,77 @@ def compress_single_pdf(input_path, output_path=None):
         print(f"Size: {format_size(original_size)}")
         print(f"Status: Already optimized (no reduction possible)")
     
+    if fits is not None:
+        if fits:
+            print(f"Target:     fits under {format_size(target_bytes)}")
+        else:
+            print(f"Target:     could not reach {format_size(target_bytes)}, kept the smallest result")
+    
     print(f"Saved to:   {output_path}")
     
     return output_path
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress every PDF in the inputs folder")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=available_cpus(),
+        help="PDFs compressed in parallel (default: CPUs available to this process)"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="recompress every input, even those unchanged since the last run"
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and compress PDFs as soon as they are written to the inputs folder"
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=None,
+        help="in --watch mode, most files handed to the pool at once (default: 2 x --jobs)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="processes used to re-encode images per PDF (default: all CPUs with --jobs 1, else 1)"
+    )
+    parser.add_argument(
+        "--target-size",
+        type=parse_size,
+        default=None,
+        help="largest acceptable output, e.g. 2MB or 500KB"
+    )
+    parser.add_argument(
+        "--min-ssim",
+        type=float,
+        default=None,
+        help="pick each image's JPEG quality as the lowest keeping SSIM above this (e.g. 0.95)"
+    )
+    args = parser.parse_args()
+    
     print("PDF Compressor Tool (with Ghostscript)")
     print("=" * 60)
     print("This tool compresses PDF files (text, images, tables)")
     print("=" * 60 + "\n")
     
-    process_all_pdfs()
+    jobs = max(args.jobs, 1)
+    workers = args.workers or (available_cpus() if jobs == 1 else 1)
+    
+    if args.watch:
+        watch_inputs(
+            workers=workers, target_bytes=args.target_size, min_ssim=args.min_ssim, jobs=jobs, backlog=args.backlog
+        )
+    else:
+        process_all_pdfs(
+            workers=workers, target_bytes=args.target_size, min_ssim=args.min_ssim, jobs=jobs, force=args.force
+        )
 
 
 
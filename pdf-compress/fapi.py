@@ -1,15 +1,29 @@
 import os
-import io
+import re
+import time
+import signal
 import shutil
 import tempfile
+import asyncio
+import threading
 import subprocess
-from PIL import Image
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import pikepdf
 from pathlib import Path
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.routing import Match
+from gs_engine import GhostscriptEngine
+from images import compress_with_pikepdf, search_target_size
+from admission import AdmissionController, Overloaded
+from metrics import Counter, Gauge, Histogram, render as render_metrics
 import uuid
+import json
+import sqlite3
+import hashlib
+import functools
 from datetime import datetime
 
 app = FastAPI(title="PDF Compressor API")
@@ -21,6 +35,185 @@ DOWNLOAD_FOLDER.mkdir(exist_ok=True)
 # Mount the downloads folder to serve files
 app.mount("/files", StaticFiles(directory=DOWNLOAD_FOLDER), name="files")
 
+# Per-strategy Ghostscript timeout in seconds
+GS_TIMEOUT = 120
+
+# Time budget in seconds for one compression on the synchronous endpoints,
+# shared by every strategy it runs. When it runs out the unfinished
+# strategies are killed and the best finished result (or the original) is
+# kept. Background jobs get the longer JOB_DEADLINE instead, since they
+# exist for documents too big to finish within a request. 0 disables
+# either deadline.
+REQUEST_DEADLINE = float(os.environ.get("PDF_COMPRESS_DEADLINE", 120))
+JOB_DEADLINE = float(os.environ.get("PDF_COMPRESS_JOB_DEADLINE", 1800))
+
+# Persistent Ghostscript interpreters reused across requests (set
+# PDF_COMPRESS_GS_ENGINE=0 to spawn a fresh `gs` per strategy instead)
+GS_ENGINE = os.environ.get("PDF_COMPRESS_GS_ENGINE", "1") != "0"
+GS_ENGINE_SIZE = int(os.environ.get("PDF_COMPRESS_GS_ENGINE_SIZE", 4))
+GS_ENGINE_MAX_JOBS = int(os.environ.get("PDF_COMPRESS_GS_ENGINE_MAX_JOBS", 50))
+
+_gs_engine = None
+_gs_engine_lock = threading.Lock()
+
+# Processes the pikepdf strategy uses to re-encode images
+IMAGE_WORKERS = int(os.environ.get("PDF_COMPRESS_IMAGE_WORKERS", 1))
+
+# Per-image JPEG quality in the pikepdf strategy: the lowest quality whose
+# SSIM stays above this threshold (e.g. 0.95). Unset keeps one fixed quality.
+MIN_SSIM = float(os.environ["PDF_COMPRESS_MIN_SSIM"]) if os.environ.get("PDF_COMPRESS_MIN_SSIM") else None
+
+# Strategies in rough order of expected cost, cheapest first
+STRATEGIES = ["pikepdf", "ghostscript_screen", "ghostscript_ebook"]
+
+# "Good enough" mode for compress_pdf: "off" runs every strategy to the end,
+# "race" runs them together and "sequential" one by one, both stopping at the
+# first result that meets target_reduction
+GOOD_ENOUGH = os.environ.get("PDF_COMPRESS_GOOD_ENOUGH", "off")
+
+# Run the pre-scan analyzer and only the strategies it routes to
+# (PDF_COMPRESS_ANALYZE=0 always runs all of STRATEGIES)
+ANALYZE = os.environ.get("PDF_COMPRESS_ANALYZE", "1") != "0"
+
+# Documents with more than SHARD_PAGES pages are split into SHARD_SIZE-page
+# shards that are compressed in parallel (SHARD_WORKERS at a time) and merged.
+# Merging only keeps pages and docinfo, so documents whose catalog has any
+# of SHARD_UNSAFE_KEYS (bookmarks, forms, named destinations, ...) are
+# never sharded
+SHARD_PAGES = int(os.environ.get("PDF_COMPRESS_SHARD_PAGES", 500))
+SHARD_UNSAFE_KEYS = ["/Outlines", "/AcroForm", "/Names", "/Dests", "/PageLabels", "/StructTreeRoot"]
+SHARD_SIZE = int(os.environ.get("PDF_COMPRESS_SHARD_SIZE", 100))
+SHARD_WORKERS = int(os.environ.get("PDF_COMPRESS_SHARD_WORKERS", os.cpu_count() or 1))
+
+# How often the candidate executor checks on running strategies
+POLL_INTERVAL = 0.05
+
+# pikepdf candidates run in a forked worker so they can be killed like gs
+_mp = multiprocessing.get_context("fork")
+
+# Worker pool the endpoints hand compression off to, so the event loop stays
+# free. "thread" is enough because the heavy lifting already happens in
+# child processes; "process" isolates compress_pdf itself as well.
+COMPRESS_POOL = os.environ.get("PDF_COMPRESS_POOL", "thread")
+COMPRESS_WORKERS = int(os.environ.get("PDF_COMPRESS_WORKERS", os.cpu_count() or 1))
+MAX_IN_FLIGHT = int(os.environ.get("PDF_COMPRESS_MAX_IN_FLIGHT", COMPRESS_WORKERS * 2))
+
+_executor = None
+_in_flight = None
+
+
+def available_memory_mb():
+    """Physical memory in MB, or the cgroup v2 memory limit if lower."""
+    memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        if limit != "max":
+            memory = min(memory, int(limit))
+    except (OSError, ValueError):
+        pass
+    return memory // 2 ** 20
+
+
+# Admission control: each request gets an estimated cost in MB of peak
+# memory (see estimate_cost) and only starts while the running requests
+# add up to at most MAX_COST_MB, by default half the memory. Up to
+# ADMISSION_QUEUE requests wait for room; beyond that they are turned
+# away with 429 and a Retry-After derived from recent throughput.
+MAX_COST_MB = int(os.environ.get("PDF_COMPRESS_MAX_COST_MB", available_memory_mb() // 2))
+ADMISSION_QUEUE = int(os.environ.get("PDF_COMPRESS_ADMISSION_QUEUE", COMPRESS_WORKERS * 4))
+COST_BASE_MB = 20
+COST_PER_MB = 3
+COST_PER_PAGE_MB = 0.25
+COST_PER_MEGAPIXEL_MB = 4
+
+_admission = None
+
+# Background jobs: uploads are kept in JOBS_FOLDER and job state in a SQLite
+# file, so queued and running jobs are picked up again after a restart. A
+# running job holds a lease its worker renews every JOB_LEASE / 3 seconds;
+# only jobs whose lease ran out are taken back (at startup and then every
+# JOB_LEASE seconds), so several uvicorn workers never run one job twice.
+JOBS_FOLDER = Path(os.environ.get("PDF_COMPRESS_JOBS_FOLDER", "jobs"))
+JOBS_DB = Path(os.environ.get("PDF_COMPRESS_JOBS_DB", "jobs.db"))
+JOB_LEASE = float(os.environ.get("PDF_COMPRESS_JOB_LEASE", 60))
+_lease_watch = None
+
+# Jobs run on their own pool of JOB_WORKERS, so a backlog of them can never
+# take the workers the synchronous endpoints need
+JOB_WORKERS = int(os.environ.get("PDF_COMPRESS_JOB_WORKERS", max(COMPRESS_WORKERS // 2, 1)))
+_job_executor = None
+_job_slots = None
+_job_tasks = set()
+
+# Starlette spools the whole multipart body before an endpoint runs, so
+# upload requests are refused up front, unread, when their Content-Length
+# is over MAX_REQUEST_BYTES (one file of MAX_UPLOAD_BYTES plus multipart
+# framing; a /compress-pdf batch must fit in it as a whole) or missing.
+# Each file is then copied to its own path in UPLOAD_CHUNK_SIZE pieces and
+# rejected past MAX_UPLOAD_BYTES.
+MAX_UPLOAD_BYTES = int(os.environ.get("PDF_COMPRESS_MAX_UPLOAD_BYTES", 200 * 1024 * 1024))
+MAX_REQUEST_BYTES = int(os.environ.get("PDF_COMPRESS_MAX_REQUEST_BYTES", MAX_UPLOAD_BYTES + 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_ROUTES = ("/compress", "/compress-pdf", "/jobs")
+
+# Content-addressed cache of finished outputs in DOWNLOAD_FOLDER, keyed by the
+# input's SHA-256 and the compression settings. The index is a SQLite file so
+# several uvicorn workers can share it; least recently used outputs are
+# deleted once they add up to more than RESULT_CACHE_MAX_BYTES.
+RESULT_CACHE = os.environ.get("PDF_COMPRESS_RESULT_CACHE", "1") != "0"
+RESULT_CACHE_DB = Path(os.environ.get("PDF_COMPRESS_RESULT_CACHE_DB", "result_cache.db"))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("PDF_COMPRESS_RESULT_CACHE_MAX_BYTES", 1024 ** 3))
+
+# Uploads and strategy outputs live in SCRATCH_DIR when it is set, e.g. to
+# the /dev/shm tmpfs so they never touch the disk; the only disk write per
+# request is then the output committed to DOWNLOAD_FOLDER. tmpfs pages
+# count against the container's memory limit, so this is opt-in and the
+# scratch bytes are added to each request's admission cost. A request
+# only uses it while it has SCRATCH_HEADROOM times the file's size free,
+# otherwise the regular temp dir.
+SCRATCH_DIR = os.environ.get("PDF_COMPRESS_SCRATCH_DIR", "")
+SCRATCH_HEADROOM = 4
+
+# Documents where every strategy finished but none saved at least
+# MIN_GAIN of the size are remembered by content hash (in the result
+# cache database) for NEGATIVE_CACHE_TTL seconds, and uploads of them in
+# that time are returned as they are without running anything. Runs
+# where a strategy failed, timed out or was cut off are not remembered.
+# PDF_COMPRESS_NEGATIVE_CACHE=0 turns this off.
+NEGATIVE_CACHE = os.environ.get("PDF_COMPRESS_NEGATIVE_CACHE", "1") != "0"
+NEGATIVE_CACHE_TTL = float(os.environ.get("PDF_COMPRESS_NEGATIVE_CACHE_TTL", 7 * 24 * 3600))
+MIN_GAIN = float(os.environ.get("PDF_COMPRESS_MIN_GAIN", 0.02))
+
+# In-process metrics served at /metrics. Strategy timings are measured where
+# compress_pdf runs and travel back in its report, so they are recorded in
+# this process whichever pool type is used.
+SIZE_BUCKETS = tuple(1024 * 2 ** i for i in range(0, 19, 2))
+
+REQUEST_LATENCY = Histogram(
+    "pdf_compress_request_duration_seconds", "HTTP request latency", ["endpoint", "status"]
+)
+UPLOAD_SIZE = Histogram("pdf_compress_upload_size_bytes", "Size of accepted uploads", buckets=SIZE_BUCKETS)
+STRATEGY_DURATION = Histogram(
+    "pdf_compress_strategy_duration_seconds", "Time spent in each compression strategy", ["strategy"]
+)
+STRATEGY_RESULTS = Counter(
+    "pdf_compress_strategy_results_total",
+    "Strategy outcomes (done, failed, timeout, cancelled)",
+    ["strategy", "result"]
+)
+STRATEGY_WINS = Counter("pdf_compress_strategy_wins_total", "Times each strategy produced the kept output", ["strategy"])
+BYTES_SAVED = Counter("pdf_compress_bytes_saved_total", "Bytes saved by compression")
+COMPRESSIONS = Counter("pdf_compress_compressions_total", "Finished compressions by cache result", ["cache"])
+SKIPPED = Counter("pdf_compress_skipped_total", "Documents returned as they were without running a strategy", ["reason"])
+COMPRESS_FAILURES = Counter("pdf_compress_failures_total", "Compressions that raised an error", ["source"])
+QUEUE_DEPTH = Gauge("pdf_compress_queue_depth", "Compressions waiting for a worker slot")
+IN_FLIGHT = Gauge("pdf_compress_in_flight", "Compressions currently running on the worker pool")
+WORKERS = Gauge("pdf_compress_workers", "Size of the compression worker pool")
+WORKERS.set(COMPRESS_WORKERS)
+IN_FLIGHT_COST = Gauge("pdf_compress_in_flight_cost_mb", "Estimated cost of the admitted compressions")
+REJECTED = Counter("pdf_compress_rejected_total", "Requests turned away with 429 by admission control")
+
 
 def setup_folders():
     input_folder = Path("inputs")
@@ -32,7 +225,7 @@ def setup_folders():
     return input_folder, output_folder
 
 
-def compress_with_ghostscript(input_path, output_path, setting="ebook"):
+def ghostscript_command(input_path, output_path, setting="ebook"):
     """
     Ghostscript PDF compression with different quality settings:
     - screen: lowest quality, smallest size (72 dpi)
@@ -40,7 +233,7 @@ def compress_with_ghostscript(input_path, output_path, setting="ebook"):
     - printer: high quality, less compression (300 dpi)
     - prepress: highest quality, minimal compression
     """
-    cmd = [
+    return [
         "gs",
         "-sDEVICE=pdfwrite",
         "-dCompatibilityLevel=1.5",
@@ -58,17 +251,11 @@ def compress_with_ghostscript(input_path, output_path, setting="ebook"):
         f"-sOutputFile={output_path}",
         input_path
     ]
-    
-    try:
-        result = subprocess.run(cmd, capture_output=True, timeout=120)
-        return result.returncode == 0
-    except Exception:
-        return False
 
 
-def compress_with_ghostscript_aggressive(input_path, output_path):
+def ghostscript_aggressive_command(input_path, output_path):
     """Even more aggressive compression with screen quality"""
-    cmd = [
+    return [
         "gs",
         "-sDEVICE=pdfwrite",
         "-dCompatibilityLevel=1.4",
@@ -89,160 +276,851 @@ def compress_with_ghostscript_aggressive(input_path, output_path):
         f"-sOutputFile={output_path}",
         input_path
     ]
+
+
+def compress_with_ghostscript(input_path, output_path, setting="ebook"):
+    cmd = ghostscript_command(input_path, output_path, setting)
     
     try:
-        result = subprocess.run(cmd, capture_output=True, timeout=120)
+        result = subprocess.run(cmd, capture_output=True, timeout=GS_TIMEOUT)
         return result.returncode == 0
     except Exception:
         return False
 
 
-def compress_image_data(image_bytes, quality=50, max_dimension=800):
+def compress_with_ghostscript_aggressive(input_path, output_path):
+    cmd = ghostscript_aggressive_command(input_path, output_path)
+    
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        
-        if img.mode in ('RGBA', 'LA'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'RGBA':
-                background.paste(img, mask=img.split()[3])
-            else:
-                background.paste(img, mask=img.split()[1])
-            img = background
-        elif img.mode == 'P':
-            img = img.convert('RGB')
-        elif img.mode not in ('RGB', 'L'):
-            img = img.convert('RGB')
-        
-        width, height = img.size
-        if width > max_dimension or height > max_dimension:
-            ratio = min(max_dimension / width, max_dimension / height)
-            new_size = (int(width * ratio), int(height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        
-        return output.getvalue(), img.size
+        result = subprocess.run(cmd, capture_output=True, timeout=GS_TIMEOUT)
+        return result.returncode == 0
     except Exception:
-        return None, None
+        return False
+
 
+#  Scratch space and output commits
 
-def compress_with_pikepdf(input_path, output_path, quality=50, max_dimension=800):
+def scratch_dir(size=0):
+    """
+    Make a temp dir in SCRATCH_DIR if it has room for SCRATCH_HEADROOM
+    times size bytes, otherwise in the regular temp dir.
+    """
+    if SCRATCH_DIR:
+        try:
+            stat = os.statvfs(SCRATCH_DIR)
+            if stat.f_bavail * stat.f_frsize > size * SCRATCH_HEADROOM:
+                return tempfile.mkdtemp(dir=SCRATCH_DIR)
+        except OSError:
+            pass
+    return tempfile.mkdtemp()
+
+
+def commit_output(source_path, output_path, keep_source=False):
+    """
+    Atomically put source_path's bytes at output_path. On the same
+    filesystem that is a rename, or a hardlink with keep_source (used for
+    a server-owned input, which must stay in place). Across filesystems,
+    e.g. from the /dev/shm scratch dir, the file is copied once to a temp
+    name next to output_path and renamed over it, so readers never see a
+    partial file.
+    """
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(output_path)), f".{uuid.uuid4().hex}.tmp")
     
     try:
-        pdf = pikepdf.open(input_path)
-        images_processed = 0
-        
-        for page in pdf.pages:
-            if '/Resources' not in page:
-                continue
-            resources = page['/Resources']
-            if '/XObject' not in resources:
-                continue
+        if keep_source:
+            os.link(source_path, temp_path)
+            os.replace(temp_path, output_path)
+        else:
+            os.replace(source_path, output_path)
+        return
+    except OSError:
+        pass
+    
+    try:
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+#  Concurrent candidate executor
+
+class Candidate:
+    """
+    One compression strategy running in its own child process. proc is
+    None when the child could not be started; it then reads as failed.
+    fallback is a one-shot gs command for a job on the persistent engine,
+    which start_fallback runs in its place if the job fails.
+    """
+
+    def __init__(self, name, output_path, proc, timeout=None, fallback=None):
+        self.name = name
+        self.output_path = output_path
+        self.proc = proc
+        self.started = time.monotonic()
+        self.timeout = timeout
+        self.fallback = fallback
+
+    @property
+    def returncode(self):
+        if self.proc is None:
+            return 1
+        if isinstance(self.proc, multiprocessing.process.BaseProcess):
+            return self.proc.exitcode
+        return self.proc.poll()
+    
+    def start_fallback(self):
+        """
+        Replace the finished, failed child with the fallback command, with
+        its own timeout from now. Returns False if there is no fallback.
+        """
+        if not self.fallback:
+            return False
+        self.reap()
+        cmd, self.fallback = self.fallback, None
+        self.proc = spawn_ghostscript(cmd)
+        self.started = time.monotonic()
+        return True
+
+    def timed_out(self):
+        return self.timeout is not None and time.monotonic() - self.started > self.timeout
+
+    def kill(self):
+        # Children run in their own session, so this also takes out any
+        # helpers they started (e.g. gs sub-processes, image workers)
+        if self.proc is None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            try:
+                self.proc.kill()
+            except Exception:
+                pass
+        self.reap()
+
+    def reap(self):
+        if self.proc is None:
+            return
+        if isinstance(self.proc, multiprocessing.process.BaseProcess):
+            self.proc.join()
+        else:
+            self.proc.wait()
+
+
+def _pikepdf_worker(input_path, output_path, quality, max_dimension):
+    os.setsid()
+    ok = compress_with_pikepdf(
+        input_path,
+        output_path,
+        quality=quality,
+        max_dimension=max_dimension,
+        workers=IMAGE_WORKERS,
+        min_ssim=MIN_SSIM
+    )
+    os._exit(0 if ok else 1)
+
+
+def get_gs_engine():
+    global _gs_engine
+    # Concurrent first requests must not each build a pool
+    with _gs_engine_lock:
+        if _gs_engine is None:
+            _gs_engine = GhostscriptEngine(
+                size=GS_ENGINE_SIZE,
+                max_jobs=GS_ENGINE_MAX_JOBS,
+                permit_paths=[JOBS_FOLDER, *([SCRATCH_DIR] if SCRATCH_DIR else [])]
+            )
+        return _gs_engine
+
+
+def spawn_ghostscript(cmd):
+    """Start a one-shot gs process, or return None if gs cannot be started."""
+    try:
+        return subprocess.Popen(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+    except OSError:
+        # gs missing or not executable: reported as a failed candidate
+        return None
+
+
+def start_ghostscript(name, cmd, output_path, input_path=None, preset=None):
+    if GS_ENGINE and preset:
+        job = get_gs_engine().submit(input_path, output_path, preset)
+        if job is not None:
+            return Candidate(name, output_path, job, timeout=GS_TIMEOUT, fallback=cmd)
+    
+    # Engine disabled, every interpreter busy or files outside its sandbox:
+    # one-shot gs process
+    return Candidate(name, output_path, spawn_ghostscript(cmd), timeout=GS_TIMEOUT)
+
+
+def start_pikepdf(name, input_path, output_path, quality=45, max_dimension=700):
+    proc = _mp.Process(
+        target=_pikepdf_worker,
+        args=(input_path, output_path, quality, max_dimension)
+    )
+    try:
+        proc.start()
+    except OSError:
+        proc = None
+    return Candidate(name, output_path, proc)
+
+
+def start_strategy(name, input_path, temp_dir):
+    """Launch one strategy by name; it writes its own file in temp_dir."""
+    if name == "ghostscript_ebook":
+        output_path = os.path.join(temp_dir, "gs_ebook.pdf")
+        return start_ghostscript(
+            name,
+            ghostscript_command(input_path, output_path, "ebook"),
+            output_path,
+            input_path,
+            "ebook"
+        )
+    
+    if name == "ghostscript_screen":
+        output_path = os.path.join(temp_dir, "gs_screen.pdf")
+        return start_ghostscript(
+            name,
+            ghostscript_aggressive_command(input_path, output_path),
+            output_path,
+            input_path,
+            "screen"
+        )
+    
+    if name == "pikepdf":
+        output_path = os.path.join(temp_dir, "pikepdf.pdf")
+        return start_pikepdf(name, input_path, output_path, quality=45, max_dimension=700)
+    
+    raise ValueError(f"Unknown strategy: {name}")
+
+
+def start_candidates(input_path, temp_dir, strategies=STRATEGIES):
+    """Launch every strategy at once, cheapest first."""
+    candidates = []
+    try:
+        for name in strategies:
+            candidates.append(start_strategy(name, input_path, temp_dir))
+    except BaseException:
+        for candidate in candidates:
+            candidate.kill()
+        raise
+    return candidates
+
+
+def collect_candidates(candidates, progress=None, target_size=None, deadline=None):
+    """
+    Wait for the running candidates and return (name, path, size) for
+    every one that succeeded, in the order they finished.
+
+    progress, if given, is called as progress(name, state) whenever a
+    strategy finishes ("done", "failed", "timeout", "deadline" or
+    "cancelled"). With target_size set, the first result at or below it
+    wins and the remaining candidates are killed. Once the monotonic
+    deadline passes, the candidates still running are killed and the
+    results so far are returned.
+    """
+    results = []
+    pending = list(candidates)
+    
+    try:
+        while pending:
+            for candidate in list(pending):
+                code = candidate.returncode
+                if code is None:
+                    if candidate.timed_out():
+                        candidate.kill()
+                        pending.remove(candidate)
+                        if progress:
+                            progress(candidate.name, "timeout")
+                    continue
+                
+                # The sandboxed interpreter can refuse what plain gs accepts
+                if code != 0 and candidate.start_fallback():
+                    continue
+                
+                candidate.reap()
+                pending.remove(candidate)
+                if code == 0 and os.path.exists(candidate.output_path):
+                    size = os.path.getsize(candidate.output_path)
+                    results.append((candidate.name, candidate.output_path, size))
+                    if progress:
+                        progress(candidate.name, "done")
+                    if target_size is not None and size <= target_size:
+                        return results
+                elif progress:
+                    progress(candidate.name, "failed")
             
-            xobjects = resources['/XObject']
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                for candidate in pending:
+                    candidate.kill()
+                    if progress:
+                        progress(candidate.name, "deadline")
+                pending = []
             
-            for name in list(xobjects.keys()):
-                try:
-                    xobj = xobjects[name]
-                    if not isinstance(xobj, pikepdf.Stream):
-                        continue
-                    
-                    if xobj.get('/Subtype') != pikepdf.Name.Image:
-                        continue
-                    
-                    width = int(xobj.get('/Width', 0))
-                    height = int(xobj.get('/Height', 0))
-                    
-                    if width < 50 or height < 50:
-                        continue
-                    
-                    try:
-                        raw_size = len(xobj.read_raw_bytes())
-                        
-                        filter_type = xobj.get('/Filter')
-                        if filter_type == pikepdf.Name.DCTDecode:
-                            image_data = xobj.read_raw_bytes()
-                        else:
-                            image_data = xobj.read_bytes()
-                        
-                        compressed_data, new_size = compress_image_data(
-                            image_data, quality=quality, max_dimension=max_dimension
-                        )
-                        
-                        if compressed_data and len(compressed_data) < raw_size * 0.9:
-                            new_stream = pikepdf.Stream(pdf, compressed_data)
-                            new_stream['/Type'] = pikepdf.Name.XObject
-                            new_stream['/Subtype'] = pikepdf.Name.Image
-                            new_stream['/Width'] = new_size[0]
-                            new_stream['/Height'] = new_size[1]
-                            new_stream['/ColorSpace'] = pikepdf.Name.DeviceRGB
-                            new_stream['/BitsPerComponent'] = 8
-                            new_stream['/Filter'] = pikepdf.Name.DCTDecode
-                            
-                            xobjects[name] = new_stream
-                            images_processed += 1
-                            
-                    except Exception:
-                        continue
-                        
-                except Exception:
-                    continue
+            if pending:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        for candidate in pending:
+            candidate.kill()
+            if progress:
+                progress(candidate.name, "cancelled")
+    
+    return results
+
+
+def run_strategies(input_path, temp_dir, strategies=STRATEGIES, progress=None,
+                   target_size=None, sequential=False, deadline=None):
+    """
+    Run strategies and return their successful results. In sequential
+    mode they run one at a time, cheapest first, stopping at the first
+    result that reaches target_size. Nothing runs past deadline.
+    """
+    if not sequential:
+        candidates = start_candidates(input_path, temp_dir, strategies)
+        try:
+            if progress:
+                for candidate in candidates:
+                    progress(candidate.name, "running")
+        except BaseException:
+            for candidate in candidates:
+                candidate.kill()
+            raise
+        return collect_candidates(candidates, progress, target_size, deadline)
+    
+    results = []
+    for name in strategies:
+        if deadline is not None and time.monotonic() >= deadline:
+            if progress:
+                progress(name, "deadline")
+            continue
         
-        pdf.save(
+        candidate = start_strategy(name, input_path, temp_dir)
+        try:
+            if progress:
+                progress(name, "running")
+        except BaseException:
+            candidate.kill()
+            raise
+        
+        results.extend(collect_candidates([candidate], progress, deadline=deadline))
+        if target_size is not None and results and results[-1][2] <= target_size:
+            break
+    
+    return results
+
+
+#  Page-range sharding
+
+def split_pdf(input_path, temp_dir, shard_size):
+    """Split input_path into consecutive page ranges; returns the shard paths."""
+    shard_paths = []
+    
+    with pikepdf.open(input_path, access_mode=pikepdf.AccessMode.mmap) as pdf:
+        for index, start in enumerate(range(0, len(pdf.pages), shard_size)):
+            shard = pikepdf.new()
+            shard.pages.extend(pdf.pages[start:start + shard_size])
+            shard_path = os.path.join(temp_dir, f"shard_{index}.pdf")
+            shard.save(shard_path)
+            shard.close()
+            shard_paths.append(shard_path)
+    
+    return shard_paths
+
+
+def _object_key(value):
+    if isinstance(value, pikepdf.Object) and value.is_indirect:
+        return ("ref", value.objgen)
+    return repr(value)
+
+
+def dedupe_streams(pdf):
+    """
+    Collapse byte-identical streams (fonts, images, ICC profiles) that the
+    shards each brought their own copy of, and point every reference at
+    the surviving copy. Returns the number of duplicates removed.
+    """
+    canonical = {}
+    duplicates = {}
+    
+    for obj in pdf.objects:
+        if not isinstance(obj, pikepdf.Stream):
+            continue
+        
+        digest = hashlib.sha256(obj.read_raw_bytes())
+        for key in sorted(obj.keys()):
+            if key != '/Length':
+                digest.update(f"{key}={_object_key(obj[key])}".encode())
+        key = digest.digest()
+        
+        if key in canonical:
+            duplicates[obj.objgen] = canonical[key]
+        else:
+            canonical[key] = obj
+    
+    if not duplicates:
+        return 0
+    
+    def repoint(container):
+        keys = range(len(container)) if isinstance(container, pikepdf.Array) else list(container.keys())
+        for key in keys:
+            value = container[key]
+            if not isinstance(value, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)):
+                continue
+            if value.is_indirect:
+                if value.objgen in duplicates:
+                    container[key] = duplicates[value.objgen]
+            else:
+                repoint(value)
+    
+    for obj in pdf.objects:
+        if isinstance(obj, (pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream)):
+            repoint(obj)
+    
+    return len(duplicates)
+
+
+def shard_unsafe_keys(pdf):
+    """Catalog entries of pdf that merge_shards would drop."""
+    return [key for key in SHARD_UNSAFE_KEYS if key in pdf.Root]
+
+
+def merge_shards(shard_paths, output_path, docinfo_from=None):
+    merged = pikepdf.new()
+    sources = []
+    
+    try:
+        for shard_path in shard_paths:
+            shard = pikepdf.open(shard_path)
+            sources.append(shard)
+            merged.pages.extend(shard.pages)
+        
+        if docinfo_from is not None:
+            with pikepdf.open(docinfo_from) as original:
+                for key, value in original.docinfo.items():
+                    merged.docinfo[key] = value
+        
+        dedupe_streams(merged)
+        merged.save(
             output_path,
             compress_streams=True,
-            object_stream_mode=pikepdf.ObjectStreamMode.generate,
-            recompress_flate=True
+            object_stream_mode=pikepdf.ObjectStreamMode.generate
         )
-        pdf.close()
-        return True
-    except Exception:
-        return False
+    finally:
+        merged.close()
+        for shard in sources:
+            shard.close()
 
 
-def compress_pdf(input_path, output_path, target_reduction=0.25):
+def pick_shard_strategy(strategies):
+    """Sharding is for splitting up long serial gs runs, so prefer those."""
+    for name in strategies:
+        if name.startswith("ghostscript"):
+            return name
+    return strategies[0]
 
-    original_size = os.path.getsize(input_path)
+
+def run_sharded(input_path, temp_dir, strategy, progress=None, deadline=None):
+    """
+    Compress input_path shard by shard with one strategy, SHARD_WORKERS
+    shards at a time, and merge the results. Shards whose compression
+    fails or comes out larger are merged in uncompressed, and so are the
+    shards left when the deadline passes, in which case the strategy is
+    reported as "deadline". Returns the usual list of (name, path, size)
+    results.
+    """
+    shard_dir = os.path.join(temp_dir, "shards")
+    os.mkdir(shard_dir)
+    shard_paths = split_pdf(input_path, shard_dir, SHARD_SIZE)
+    best_paths = list(shard_paths)
     
-    temp_dir = tempfile.mkdtemp()
-    temp_gs_ebook = os.path.join(temp_dir, "gs_ebook.pdf")
-    temp_gs_screen = os.path.join(temp_dir, "gs_screen.pdf")
-    temp_pikepdf = os.path.join(temp_dir, "pikepdf.pdf")
+    if progress:
+        progress(strategy, "running")
     
-    results = []
+    queue = list(enumerate(shard_paths))
+    running = {}
+    cut_off = False
     
     try:
-        if compress_with_ghostscript(input_path, temp_gs_ebook, "ebook"):
-            size = os.path.getsize(temp_gs_ebook)
-            results.append(("ghostscript_ebook", temp_gs_ebook, size))
+        while queue or running:
+            while queue and len(running) < SHARD_WORKERS:
+                index, shard_path = queue.pop(0)
+                work_dir = os.path.join(shard_dir, str(index))
+                os.mkdir(work_dir)
+                running[index] = start_strategy(strategy, shard_path, work_dir)
+            
+            for index, candidate in list(running.items()):
+                code = candidate.returncode
+                if code is None and not candidate.timed_out():
+                    continue
+                if code and candidate.start_fallback():
+                    continue
+                
+                if code is None:
+                    candidate.kill()
+                else:
+                    candidate.reap()
+                del running[index]
+                
+                if code == 0 and os.path.exists(candidate.output_path):
+                    if os.path.getsize(candidate.output_path) < os.path.getsize(shard_paths[index]):
+                        best_paths[index] = candidate.output_path
+            
+            if (queue or running) and deadline is not None and time.monotonic() >= deadline:
+                # The finally below kills the running shards
+                cut_off = True
+                break
+            
+            if running:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        for candidate in running.values():
+            candidate.kill()
+    
+    if not cut_off and best_paths == shard_paths:
+        # Every shard failed (e.g. gs could not start) or grew
+        if progress:
+            progress(strategy, "failed")
+        return []
+    
+    output_path = os.path.join(temp_dir, f"sharded_{strategy}.pdf")
+    try:
+        merge_shards(best_paths, output_path, docinfo_from=input_path)
+    except Exception:
+        if progress:
+            progress(strategy, "failed")
+        return []
+    
+    if progress:
+        progress(strategy, "deadline" if cut_off else "done")
+    return [(f"sharded_{strategy}", output_path, os.path.getsize(output_path))]
+
+
+#  Pre-scan analyzer
+
+def _stream_length(obj):
+    length = obj.get('/Length')
+    if isinstance(length, int):
+        return length
+    try:
+        return int(length)
+    except Exception:
+        return len(obj.read_raw_bytes())
+
+
+def _filter_name(obj):
+    filters = obj.get('/Filter')
+    if filters is None:
+        return "none"
+    if isinstance(filters, pikepdf.Array):
+        return "+".join(str(f)[1:] for f in filters) or "none"
+    return str(filters)[1:]
+
+
+def analyze_pdf(input_path):
+    """
+    Cheap structural scan of a PDF: stream bytes by category, image bytes
+    by filter, page count and total image pixels. Stream data is not
+    decoded, only /Length is read.
+    """
+    analysis = {
+        "page_count": 0,
+        "file_size": os.path.getsize(input_path),
+        "bytes": {"images": 0, "fonts": 0, "content": 0, "metadata": 0, "other": 0},
+        "image_bytes_by_filter": {},
+        "image_count": 0,
+        "image_pixels": 0,
+        "embedded_fonts": 0,
+        "subset_fonts": 0,
+        "object_streams": 0,
+        "incremental_update": False,
+        "shard_unsafe": [],
+    }
+    
+    with pikepdf.open(input_path, access_mode=pikepdf.AccessMode.mmap) as pdf:
+        analysis["page_count"] = len(pdf.pages)
+        analysis["incremental_update"] = '/Prev' in pdf.trailer
+        analysis["shard_unsafe"] = shard_unsafe_keys(pdf)
         
-        if compress_with_ghostscript_aggressive(input_path, temp_gs_screen):
-            size = os.path.getsize(temp_gs_screen)
-            results.append(("ghostscript_screen", temp_gs_screen, size))
+        content_ids = set()
+        font_ids = set()
+        for page in pdf.pages:
+            contents = page.obj.get('/Contents')
+            if isinstance(contents, pikepdf.Array):
+                content_ids.update(c.objgen for c in contents)
+            elif contents is not None:
+                content_ids.add(contents.objgen)
         
-        if compress_with_pikepdf(input_path, temp_pikepdf, quality=45, max_dimension=700):
-            size = os.path.getsize(temp_pikepdf)
-            results.append(("pikepdf", temp_pikepdf, size))
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Dictionary) and obj.get('/Type') == pikepdf.Name.FontDescriptor:
+                embedded = False
+                for key in ('/FontFile', '/FontFile2', '/FontFile3'):
+                    if key in obj:
+                        font_ids.add(obj[key].objgen)
+                        embedded = True
+                if embedded:
+                    analysis["embedded_fonts"] += 1
+                    # Subset fonts are named with a six-letter tag, e.g. /ABCDEF+Calibri
+                    if re.match(r"/[A-Z]{6}\+", str(obj.get('/FontName', ''))):
+                        analysis["subset_fonts"] += 1
         
-        if not results:
+        for obj in pdf.objects:
+            if not isinstance(obj, pikepdf.Stream):
+                continue
+            
+            size = _stream_length(obj)
+            if obj.get('/Subtype') == pikepdf.Name.Image:
+                name = _filter_name(obj)
+                by_filter = analysis["image_bytes_by_filter"]
+                by_filter[name] = by_filter.get(name, 0) + size
+                analysis["bytes"]["images"] += size
+                analysis["image_count"] += 1
+                analysis["image_pixels"] += int(obj.get('/Width', 0)) * int(obj.get('/Height', 0))
+            elif obj.objgen in font_ids:
+                analysis["bytes"]["fonts"] += size
+            elif obj.objgen in content_ids:
+                analysis["bytes"]["content"] += size
+            elif obj.get('/Type') == pikepdf.Name.Metadata:
+                analysis["bytes"]["metadata"] += size
+            else:
+                if obj.get('/Type') == pikepdf.Name.ObjStm:
+                    analysis["object_streams"] += 1
+                analysis["bytes"]["other"] += size
+    
+    return analysis
+
+
+def predict_no_gain(analysis):
+    """
+    Return why an analyzed document is not worth compressing, or None.
+    With no images, every embedded font already subset, object streams
+    in use and no incremental updates left to fold in, there is nothing
+    left for the strategies to shrink.
+    """
+    if (
+        analysis["image_count"] == 0
+        and analysis["subset_fonts"] == analysis["embedded_fonts"]
+        and analysis["object_streams"] > 0
+        and not analysis["incremental_update"]
+    ):
+        return "already optimized: no images, subset fonts, object streams"
+    return None
+
+
+def route_strategies(analysis):
+    """
+    Pick the strategies likely to win for an analyzed document.
+    Returns (strategies, reason).
+    """
+    total = max(analysis["file_size"], 1)
+    image_bytes = analysis["bytes"]["images"]
+    
+    if image_bytes < total * 0.1:
+        # Text-heavy: savings come from stream recompression and font subsetting
+        return ["pikepdf", "ghostscript_ebook"], "few or no images"
+    
+    # Chains such as FlateDecode+DCTDecode are JPEGs too
+    dct_bytes = sum(
+        size for name, size in analysis["image_bytes_by_filter"].items()
+        if name.endswith("DCTDecode")
+    )
+    if dct_bytes >= image_bytes * 0.5:
+        return ["pikepdf", "ghostscript_screen"], "mostly JPEG images"
+    
+    # pikepdf decodes raw and Flate samples itself (decode_raw_image)
+    return ["pikepdf", "ghostscript_screen", "ghostscript_ebook"], "mostly non-JPEG images"
+
+
+def compress_pdf_with_report(input_path, output_path, target_reduction=0.25, progress=None,
+                             good_enough=None, deadline=None, owned_input=False):
+    """
+    Like compress_pdf, but also returns a report dict with the pre-scan
+    analysis, the strategies that ran, which one won and which were cut
+    off by the deadline (a time.monotonic() value; None means no limit).
+    owned_input says input_path is the server's own file (a temp upload or
+    job input), which an unimproved output may share by hardlink; a
+    caller's file is always copied.
+    """
+    if good_enough is None:
+        good_enough = GOOD_ENOUGH
+
+    original_size = os.path.getsize(input_path)
+    report = {"analysis": None, "strategies": STRATEGIES, "routing": "all strategies", "winner": None}
+    
+    # Record how long each strategy ran and how it ended, then pass the
+    # update on to the caller's progress callback
+    timings = report["timings"] = {}
+    cut_off = report["cut_off"] = []
+    started = {}
+    
+    def track(name, state):
+        if state == "running":
+            started[name] = time.monotonic()
+        elif name in started:
+            timings[name] = {"state": state, "seconds": time.monotonic() - started.pop(name)}
+        if state == "deadline":
+            cut_off.append(name)
+        if progress:
+            progress(name, state)
+    
+    def keep_original():
+        if owned_input:
+            commit_output(input_path, output_path, keep_source=True)
+        else:
             shutil.copy2(input_path, output_path)
-            return original_size, original_size
+    
+    def skip(reason, routing):
+        report["skipped"] = reason
+        report["strategies"] = []
+        report["routing"] = routing
+        report["results"] = {}
+        keep_original()
+        return original_size, original_size, report
+    
+    negative_key = None
+    if NEGATIVE_CACHE:
+        negative_key = result_cache_key(input_path, compression_settings(target_reduction, good_enough))
+        if negative_cache_get(negative_key):
+            return skip("negative_cache", "skipped: no gain on an earlier upload")
+    
+    if ANALYZE:
+        try:
+            report["analysis"] = analyze_pdf(input_path)
+            reason = predict_no_gain(report["analysis"])
+            if reason:
+                return skip("predicted", f"skipped, {reason}")
+            report["strategies"], report["routing"] = route_strategies(report["analysis"])
+        except Exception as e:
+            report["routing"] = f"all strategies (analysis failed: {e})"
+    
+    target_size = None
+    if good_enough in ("race", "sequential"):
+        target_size = original_size * (1 - target_reduction)
+    
+    if report["analysis"] is not None:
+        page_count = report["analysis"]["page_count"]
+        shard_unsafe = report["analysis"]["shard_unsafe"]
+    else:
+        try:
+            with pikepdf.open(input_path, access_mode=pikepdf.AccessMode.mmap) as pdf:
+                page_count = len(pdf.pages)
+                shard_unsafe = shard_unsafe_keys(pdf)
+        except Exception:
+            page_count = 0
+            shard_unsafe = []
+    
+    if page_count > SHARD_PAGES and shard_unsafe:
+        report["shard_skipped"] = f"merging would drop {', '.join(shard_unsafe)}"
+    
+    temp_dir = scratch_dir(original_size)
+    
+    try:
+        if page_count > SHARD_PAGES and not shard_unsafe:
+            strategy = pick_shard_strategy(report["strategies"])
+            report["sharded"] = {"strategy": strategy, "shards": -(-page_count // SHARD_SIZE)}
+            results = run_sharded(input_path, temp_dir, strategy, progress=track, deadline=deadline)
+        else:
+            results = run_strategies(
+                input_path,
+                temp_dir,
+                strategies=report["strategies"],
+                progress=track,
+                target_size=target_size,
+                sequential=good_enough == "sequential",
+                deadline=deadline
+            )
+        report["results"] = {name: size for name, path, size in results}
+        
+        if not results:
+            keep_original()
+            return original_size, original_size, report
         
         results.sort(key=lambda x: x[2])
         best_name, best_path, best_size = results[0]
         
+        # Only a run where every strategy got to finish says the document
+        # cannot be compressed; a failed or killed one may just be unlucky
+        ran = [report["sharded"]["strategy"]] if report.get("sharded") else report["strategies"]
+        finished = all(timings.get(name, {}).get("state") == "done" for name in ran)
+        if negative_key and finished and best_size > original_size * (1 - MIN_GAIN):
+            negative_cache_put(negative_key, original_size, best_size)
+        
         if best_size < original_size:
-            shutil.copy2(best_path, output_path)
-            return original_size, best_size
+            commit_output(best_path, output_path)
+            report["winner"] = best_name
+            return original_size, best_size, report
         else:
-            shutil.copy2(input_path, output_path)
-            return original_size, original_size
+            keep_original()
+            return original_size, original_size, report
             
     finally:
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
+def compress_pdf(input_path, output_path, target_reduction=0.25, progress=None, good_enough=None):
+    """
+    Compress input_path into output_path and return (original_size,
+    compressed_size). The pre-scan analyzer picks which strategies run
+    and the smallest result is kept. good_enough ("race" or
+    "sequential", default GOOD_ENOUGH) instead stops as soon as one
+    strategy saves target_reduction of the original size.
+    """
+    original_size, compressed_size, report = compress_pdf_with_report(
+        input_path, output_path, target_reduction, progress, good_enough
+    )
+    return original_size, compressed_size
+
+
+#  Target-size mode
+
+def compress_to_target(input_path, output_path, target_bytes, progress=None, deadline=None, owned_input=False):
+    """
+    Compress input_path to at most target_bytes. The regular strategies
+    run first; if their best result is still too big the image settings
+    are searched with search_target_size. Returns the same triple as
+    compress_pdf_with_report, whose report gains a "target" entry saying
+    whether the output fits.
+    """
+    original_size, compressed_size, report = compress_pdf_with_report(
+        input_path, output_path, progress=progress, deadline=deadline, owned_input=owned_input
+    )
+    target = report["target"] = {"target_bytes": target_bytes, "passes": 0}
+    
+    # The search checks the deadline before every pass and keeps its best
+    # result so far when it runs out
+    if compressed_size > target_bytes and deadline is not None and time.monotonic() >= deadline:
+        report["cut_off"].append("target_search")
+    elif compressed_size > target_bytes:
+        temp_dir = scratch_dir(original_size)
+        temp_output = os.path.join(temp_dir, "target.pdf")
+        try:
+            size = search_target_size(
+                input_path, temp_output, target_bytes, target, workers=IMAGE_WORKERS, deadline=deadline
+            )
+            if target.pop("cut_off", False):
+                report["cut_off"].append("target_search")
+            if size is not None and size < compressed_size:
+                commit_output(temp_output, output_path)
+                compressed_size = size
+                report["winner"] = "target_search"
+        except Exception as e:
+            target["error"] = str(e)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    target["fits"] = compressed_size <= target_bytes
+    return original_size, compressed_size, report
+
+
 def format_size(size_bytes):
     if size_bytes < 1024:
         return f"{size_bytes} B"
@@ -252,8 +1130,687 @@ def format_size(size_bytes):
         return f"{size_bytes / (1024 * 1024):.2f} MB"
 
 
+#  Result cache
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compression_settings(target_reduction=0.25, good_enough=None, target_bytes=None):
+    """Everything besides the input bytes that can change the output."""
+    return {
+        "target_reduction": target_reduction,
+        "target_bytes": target_bytes,
+        "good_enough": good_enough or GOOD_ENOUGH,
+        "analyze": ANALYZE,
+        "strategies": STRATEGIES,
+        "min_ssim": MIN_SSIM,
+        "shard_pages": SHARD_PAGES,
+        "shard_size": SHARD_SIZE,
+    }
+
+
+def result_cache_key(input_path, settings):
+    settings_json = json.dumps(settings, sort_keys=True)
+    return f"{file_sha256(input_path)}-{hashlib.sha256(settings_json.encode()).hexdigest()[:16]}"
+
+
+def result_cache_db():
+    conn = sqlite3.connect(RESULT_CACHE_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            output_filename TEXT NOT NULL,
+            original_size INTEGER NOT NULL,
+            compressed_size INTEGER NOT NULL,
+            report TEXT,
+            last_used REAL NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS no_gain (
+            key TEXT PRIMARY KEY,
+            original_size INTEGER NOT NULL,
+            best_size INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def result_cache_get(key):
+    """Return the cached row for key, or None if missing or its file is gone."""
+    with result_cache_db() as conn:
+        row = conn.execute("SELECT * FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        
+        if not (DOWNLOAD_FOLDER / row["output_filename"]).exists():
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        
+        conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return dict(row)
+
+
+def result_cache_put(key, output_filename, original_size, compressed_size, report):
+    with result_cache_db() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO results "
+            "(key, output_filename, original_size, compressed_size, report, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, output_filename, original_size, compressed_size, json.dumps(report), time.time())
+        )
+    result_cache_evict()
+
+
+def negative_cache_get(key):
+    """True if a run of this document and settings in the last NEGATIVE_CACHE_TTL seconds saved less than MIN_GAIN."""
+    with result_cache_db() as conn:
+        row = conn.execute(
+            "SELECT 1 FROM no_gain WHERE key = ? AND created_at > ?",
+            (key, time.time() - NEGATIVE_CACHE_TTL)
+        ).fetchone()
+    return row is not None
+
+
+def negative_cache_put(key, original_size, best_size):
+    with result_cache_db() as conn:
+        conn.execute("DELETE FROM no_gain WHERE created_at <= ?", (time.time() - NEGATIVE_CACHE_TTL,))
+        conn.execute(
+            "INSERT OR REPLACE INTO no_gain (key, original_size, best_size, created_at) VALUES (?, ?, ?, ?)",
+            (key, original_size, best_size, time.time())
+        )
+
+
+def result_cache_evict():
+    """Drop least recently used entries until the cache fits its byte budget."""
+    conn = result_cache_db()
+    evicted = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        total = conn.execute("SELECT COALESCE(SUM(compressed_size), 0) FROM results").fetchone()[0]
+        if total > RESULT_CACHE_MAX_BYTES:
+            rows = conn.execute(
+                "SELECT key, output_filename, compressed_size FROM results ORDER BY last_used"
+            ).fetchall()
+            for row in rows:
+                if total <= RESULT_CACHE_MAX_BYTES:
+                    break
+                evicted.append(row["output_filename"])
+                conn.execute("DELETE FROM results WHERE key = ?", (row["key"],))
+                total -= row["compressed_size"]
+        conn.commit()
+    finally:
+        conn.close()
+    
+    # Files are only removed once no other worker can hand them out
+    for output_filename in evicted:
+        try:
+            os.remove(DOWNLOAD_FOLDER / output_filename)
+        except OSError:
+            pass
+
+
+def compress_to_downloads(input_path, output_filename, progress=None, target_bytes=None, time_budget=0):
+    """
+    Compress input_path into DOWNLOAD_FOLDER / output_filename, or reuse the
+    output of an identical earlier upload. Returns (output_filename,
+    original_size, compressed_size, report); on a cache hit output_filename
+    is the cached file's name. With target_bytes the output is squeezed
+    under that size where possible (see compress_to_target). time_budget
+    is the deadline in seconds from the start of compression, 0 for none.
+    input_path is always the server's own temp upload or job input.
+    """
+    key = None
+    if RESULT_CACHE:
+        key = result_cache_key(input_path, compression_settings(target_bytes=target_bytes))
+        cached = result_cache_get(key)
+        if cached is not None:
+            report = json.loads(cached["report"]) if cached["report"] else {}
+            report["cache"] = "hit"
+            return cached["output_filename"], cached["original_size"], cached["compressed_size"], report
+    
+    output_path = str(DOWNLOAD_FOLDER / output_filename)
+    deadline = time.monotonic() + time_budget if time_budget > 0 else None
+    if target_bytes:
+        original_size, compressed_size, report = compress_to_target(
+            input_path, output_path, target_bytes, progress=progress, deadline=deadline, owned_input=True
+        )
+    else:
+        original_size, compressed_size, report = compress_pdf_with_report(
+            input_path, output_path, progress=progress, deadline=deadline, owned_input=True
+        )
+    
+    if key is not None:
+        # A result cut off by the deadline may do better next time, so it is not cached
+        if not report.get("cut_off"):
+            result_cache_put(key, output_filename, original_size, compressed_size, report)
+        report["cache"] = "miss"
+    
+    return output_filename, original_size, compressed_size, report
+
+
+#  Uploads
+
+class UploadError(Exception):
+    """An upload that was rejected before compression started."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def save_upload(file, path, max_bytes=None):
+    """
+    Copy an UploadFile to path chunk by chunk, so memory use stays flat
+    whatever the upload size. Raises UploadError if the first chunk has no
+    %PDF- header or the file is over max_bytes (MAX_UPLOAD_BYTES). The body
+    has been read by then; limit_upload_size refuses large requests unread.
+    """
+    if max_bytes is None:
+        max_bytes = MAX_UPLOAD_BYTES
+    
+    too_large = f"File exceeds the {format_size(max_bytes)} upload limit"
+    if file.size is not None and file.size > max_bytes:
+        raise UploadError(too_large, status_code=413)
+    
+    written = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                
+                # The header may be preceded by a little junk, as readers allow
+                if written == 0 and b"%PDF-" not in chunk[:1024]:
+                    raise UploadError("File is not a valid PDF")
+                
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadError(too_large, status_code=413)
+                
+                f.write(chunk)
+        
+        if written == 0:
+            raise UploadError("File is empty")
+        
+        UPLOAD_SIZE.observe(written)
+    except Exception:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        raise
+    
+    return written
+
+
+#  Worker pool
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if COMPRESS_POOL == "process":
+            _executor = ProcessPoolExecutor(max_workers=COMPRESS_WORKERS, mp_context=_mp)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=COMPRESS_WORKERS, thread_name_prefix="compress"
+            )
+    return _executor
+
+
+def get_job_executor():
+    global _job_executor
+    if _job_executor is None:
+        if COMPRESS_POOL == "process":
+            _job_executor = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=_mp)
+        else:
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    return _job_executor
+
+
+def get_admission():
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController(MAX_COST_MB, ADMISSION_QUEUE)
+    return _admission
+
+
+def estimate_cost(input_path):
+    """
+    Rough peak memory in MB for compressing input_path, from its size,
+    page count and image pixels, plus its scratch files when those live in
+    tmpfs. Nothing is decoded, so this is cheap.
+    """
+    size_mb = os.path.getsize(input_path) / 2 ** 20
+    pages = 0
+    pixels = 0
+    try:
+        with pikepdf.open(input_path, access_mode=pikepdf.AccessMode.mmap) as pdf:
+            pages = len(pdf.pages)
+            for obj in pdf.objects:
+                if isinstance(obj, pikepdf.Stream) and obj.get('/Subtype') == pikepdf.Name.Image:
+                    pixels += int(obj.get('/Width', 0)) * int(obj.get('/Height', 0))
+    except Exception:
+        pass
+    
+    return (
+        COST_BASE_MB
+        + size_mb * COST_PER_MB
+        + pages * COST_PER_PAGE_MB
+        + pixels / 1e6 * COST_PER_MEGAPIXEL_MB
+        + (size_mb * SCRATCH_HEADROOM if SCRATCH_DIR else 0)
+    )
+
+
+async def run_in_pool(func, *args, cost=0):
+    """
+    Run func(*args) on the worker pool, at most MAX_IN_FLIGHT at a time
+    and once admission control has room for cost. Raises Overloaded if
+    the admission queue is full.
+    """
+    global _in_flight
+    if _in_flight is None:
+        _in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+    admission = get_admission()
+    
+    QUEUE_DEPTH.inc()
+    try:
+        await admission.acquire(cost)
+        try:
+            await _in_flight.acquire()
+        except BaseException:
+            admission.release(cost, finished=False)
+            raise
+    except Overloaded:
+        REJECTED.inc()
+        raise
+    finally:
+        QUEUE_DEPTH.dec()
+    
+    IN_FLIGHT.inc()
+    IN_FLIGHT_COST.set(admission.in_flight_cost)
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), func, *args)
+    finally:
+        IN_FLIGHT.dec()
+        _in_flight.release()
+        admission.release(cost)
+        IN_FLIGHT_COST.set(admission.in_flight_cost)
+
+
+def record_compression(original_size, compressed_size, report):
+    """Feed one finished compression's report into the metrics."""
+    COMPRESSIONS.inc(cache=report.get("cache", "off"))
+    if report.get("cache") == "hit":
+        return
+    
+    for name, timing in report.get("timings", {}).items():
+        STRATEGY_DURATION.observe(timing["seconds"], strategy=name)
+        STRATEGY_RESULTS.inc(strategy=name, result=timing["state"])
+    
+    if report.get("skipped"):
+        SKIPPED.inc(reason=report["skipped"])
+    if report.get("winner"):
+        STRATEGY_WINS.inc(strategy=report["winner"])
+    BYTES_SAVED.inc(max(original_size - compressed_size, 0))
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+    
+    # Jobs still queued here stay 'queued' in the database and resume at the next startup
+    global _job_executor
+    if _job_executor is not None:
+        _job_executor.shutdown(wait=False, cancel_futures=True)
+        _job_executor = None
+    
+    global _gs_engine
+    with _gs_engine_lock:
+        if _gs_engine is not None:
+            _gs_engine.shutdown()
+            _gs_engine = None
+
+
+#  Background jobs
+
+def jobs_db():
+    conn = sqlite3.connect(JOBS_DB, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def init_jobs_db():
+    JOBS_FOLDER.mkdir(exist_ok=True)
+    with jobs_db() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                input_path TEXT NOT NULL,
+                output_filename TEXT NOT NULL,
+                status TEXT NOT NULL,
+                progress TEXT NOT NULL DEFAULT '{}',
+                original_size INTEGER,
+                compressed_size INTEGER,
+                error TEXT,
+                report TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """
+        )
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "report" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN report TEXT")
+        if "owner" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner INTEGER")
+        if "lease_until" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+
+
+def create_job(job_id, filename, input_path, output_filename):
+    now = datetime.now().isoformat()
+    with jobs_db() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, filename, input_path, output_filename, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, filename, input_path, output_filename, now, now)
+        )
+
+
+def update_job(job_id, **fields):
+    fields["updated_at"] = datetime.now().isoformat()
+    columns = ", ".join(f"{key} = ?" for key in fields)
+    with jobs_db() as conn:
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+
+def update_job_progress(job_id, strategy, state):
+    with jobs_db() as conn:
+        row = conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return
+        progress = json.loads(row["progress"])
+        progress[strategy] = state
+        conn.execute(
+            "UPDATE jobs SET progress = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(progress), datetime.now().isoformat(), job_id)
+        )
+
+
+def renew_lease(job_id):
+    with jobs_db() as conn:
+        conn.execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running' AND owner = ?",
+            (time.time() + JOB_LEASE, job_id, os.getpid())
+        )
+
+
+def get_job(job_id):
+    with jobs_db() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def process_job(job_id):
+    """
+    Run one queued job to completion on a pool worker. Returns
+    (original_size, compressed_size, report) on success, False if the
+    compression failed and None if another worker already claimed the job.
+    """
+    # Claim the job atomically so it is never run twice
+    with jobs_db() as conn:
+        claimed = conn.execute(
+            "UPDATE jobs SET status = 'running', progress = '{}', owner = ?, lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (os.getpid(), time.time() + JOB_LEASE, datetime.now().isoformat(), job_id)
+        ).rowcount
+    if not claimed:
+        return
+    
+    job = get_job(job_id)
+    
+    stop_heartbeat = threading.Event()
+    
+    def heartbeat():
+        while not stop_heartbeat.wait(JOB_LEASE / 3):
+            try:
+                renew_lease(job_id)
+            except sqlite3.Error:
+                pass
+    
+    threading.Thread(target=heartbeat, daemon=True).start()
+    
+    try:
+        output_filename, original_size, compressed_size, report = compress_to_downloads(
+            job["input_path"],
+            job["output_filename"],
+            progress=functools.partial(update_job_progress, job_id),
+            time_budget=JOB_DEADLINE
+        )
+        update_job(
+            job_id,
+            status="done",
+            output_filename=output_filename,
+            original_size=original_size,
+            compressed_size=compressed_size,
+            report=json.dumps(report)
+        )
+    except Exception as e:
+        update_job(job_id, status="failed", error=str(e))
+        return False
+    finally:
+        stop_heartbeat.set()
+        # A finished job, failed or not, is never run again
+        try:
+            os.remove(job["input_path"])
+        except OSError:
+            pass
+    
+    return original_size, compressed_size, report
+
+
+async def run_job(job_id):
+    """
+    Run one job on the job pool once one of its JOB_WORKERS slots is free
+    and admission control has room for its cost, which stays charged
+    until the job ends, so jobs and synchronous requests share one budget.
+    """
+    global _job_slots
+    if _job_slots is None:
+        _job_slots = asyncio.Semaphore(JOB_WORKERS)
+    admission = get_admission()
+    
+    async with _job_slots:
+        job = get_job(job_id)
+        if job is None or job["status"] != "queued":
+            return
+        try:
+            cost = await asyncio.to_thread(estimate_cost, job["input_path"])
+        except OSError:
+            cost = COST_BASE_MB
+        
+        # The job is already accepted, so a full admission queue only delays it
+        while True:
+            try:
+                await admission.acquire(cost)
+                break
+            except Overloaded as e:
+                await asyncio.sleep(e.retry_after)
+        
+        IN_FLIGHT_COST.set(admission.in_flight_cost)
+        outcome = None
+        try:
+            loop = asyncio.get_running_loop()
+            outcome = await loop.run_in_executor(get_job_executor(), process_job, job_id)
+        except Exception:
+            outcome = False
+        finally:
+            admission.release(cost, finished=outcome is not None)
+            IN_FLIGHT_COST.set(admission.in_flight_cost)
+    
+    if outcome is False:
+        COMPRESS_FAILURES.inc(source="jobs")
+    elif outcome is not None:
+        record_compression(*outcome)
+
+
+def submit_job(job_id):
+    task = asyncio.create_task(run_job(job_id))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+
+
+def reclaim_jobs():
+    """Put running jobs whose lease ran out back in the queue and return their ids."""
+    now = time.time()
+    reclaimed = []
+    with jobs_db() as conn:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+            (now,)
+        ).fetchall()
+        for row in rows:
+            # Another worker may renew or reclaim it in between
+            if conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL "
+                "WHERE id = ? AND status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (row["id"], now)
+            ).rowcount:
+                reclaimed.append(row["id"])
+    return reclaimed
+
+
+async def watch_leases():
+    # Jobs of a worker that died while this one runs are only reclaimed here
+    while True:
+        await asyncio.sleep(JOB_LEASE)
+        try:
+            for job_id in await asyncio.to_thread(reclaim_jobs):
+                submit_job(job_id)
+        except Exception:
+            pass
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    global _lease_watch
+    init_jobs_db()
+    reclaim_jobs()
+    with jobs_db() as conn:
+        rows = conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+        ).fetchall()
+    
+    for row in rows:
+        submit_job(row["id"])
+    
+    _lease_watch = asyncio.create_task(watch_leases())
+
+
 #  FastAPI Routes
 
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.method == "POST" and request.url.path in UPLOAD_ROUTES:
+        length = request.headers.get("content-length")
+        if length is None or not length.isdigit():
+            return JSONResponse(
+                status_code=411,
+                content={
+                    "status": "error",
+                    "message": "Uploads need a Content-Length header"
+                }
+            )
+        
+        if int(length) > MAX_REQUEST_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={
+                    "status": "error",
+                    "message": f"Request exceeds the {format_size(MAX_REQUEST_BYTES)} upload limit"
+                }
+            )
+    
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def shed_load(request: Request, call_next):
+    # A request the admission queue would turn away anyway is refused before
+    # its body is uploaded and parsed; the cost is a guess from the body size
+    # until estimate_cost runs on the admitted file. Job submissions are
+    # checked too, since each job is charged the same way when it runs.
+    if request.method == "POST" and request.url.path in UPLOAD_ROUTES:
+        length = request.headers.get("content-length", "")
+        size_mb = int(length) / 2 ** 20 if length.isdigit() else 0
+        try:
+            get_admission().check(COST_BASE_MB + size_mb * COST_PER_MB)
+        except Overloaded as e:
+            REJECTED.inc()
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(e.retry_after)},
+                content={
+                    "status": "error",
+                    "message": str(e)
+                }
+            )
+    
+    return await call_next(request)
+
+
+def route_template(scope):
+    """
+    The path template of the route scope was or would have been routed to,
+    or "unmatched". Templates keep job ids and file names out of labels.
+    """
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Requests the middlewares above turned away never reached the router
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+# Registered last so it is the outermost middleware and also times the
+# requests the ones above turn away
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        endpoint = route_template(request.scope)
+        REQUEST_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint, status=status)
+
+
 @app.get("/")
 async def root():
     """Welcome endpoint"""
@@ -265,8 +1822,17 @@ async def root():
 
 
 @app.post("/compress")
-async def compress_pdf_endpoint(file: UploadFile = File(...)):
+async def compress_pdf_endpoint(file: UploadFile = File(...), target_bytes: int | None = None):
 
+    if target_bytes is not None and target_bytes <= 0:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "target_bytes must be a positive number of bytes"
+            }
+        )
+    
     # Validate file type
     if not file.filename.lower().endswith('.pdf'):
         return JSONResponse(
@@ -278,25 +1844,26 @@ async def compress_pdf_endpoint(file: UploadFile = File(...)):
         )
     
     temp_input = None
-    output_file = None
     
     try:
         # Create temporary input file
-        temp_dir = tempfile.mkdtemp()
+        temp_dir = scratch_dir(file.size or MAX_UPLOAD_BYTES)
         temp_input = os.path.join(temp_dir, file.filename)
         
-        # Save uploaded file to temporary location
-        file_content = await file.read()
-        with open(temp_input, 'wb') as f:
-            f.write(file_content)
+        # Stream uploaded file to temporary location
+        await save_upload(file, temp_input)
+        cost = await asyncio.to_thread(estimate_cost, temp_input)
         
         # Create output filename with unique UUID
         unique_id = str(uuid.uuid4())
         output_filename = f"{unique_id}.pdf"
-        output_file = DOWNLOAD_FOLDER / output_filename
         
-        # Compress the PDF
-        original_size, compressed_size = compress_pdf(str(temp_input), str(output_file))
+        # Compress the PDF (or reuse the result for an identical upload)
+        output_filename, original_size, compressed_size, report = await run_in_pool(
+            compress_to_downloads, str(temp_input), output_filename, None, target_bytes, REQUEST_DEADLINE,
+            cost=cost
+        )
+        record_compression(original_size, compressed_size, report)
         
         # Calculate reduction percentage
         if compressed_size < original_size:
@@ -307,21 +1874,47 @@ async def compress_pdf_endpoint(file: UploadFile = File(...)):
         # Generate download link
         download_link = f"http://127.0.0.1:8000/files/{output_filename}"
         
+        details = {
+            "original_size": format_size(original_size),
+            "compressed_size": format_size(compressed_size),
+            "reduction_percentage": f"{reduction:.1f}%"
+        }
+        if target_bytes:
+            details["target_size"] = format_size(target_bytes)
+            details["fits_target"] = report["target"]["fits"] if "target" in report else compressed_size <= target_bytes
+        
         return JSONResponse(
             status_code=200,
             content={
                 "status": "success",
                 "message": "PDF successfully compressed!",
                 "download_link": download_link,
-                "details": {
-                    "original_size": format_size(original_size),
-                    "compressed_size": format_size(compressed_size),
-                    "reduction_percentage": f"{reduction:.1f}%"
-                }
+                "details": details,
+                "report": report
             }
         )
         
+    except UploadError as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "status": "error",
+                "message": str(e)
+            }
+        )
+    
+    except Overloaded as e:
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            content={
+                "status": "error",
+                "message": str(e)
+            }
+        )
+    
     except Exception as e:
+        COMPRESS_FAILURES.inc(source="compress")
         return JSONResponse(
             status_code=500,
             content={
@@ -332,7 +1925,7 @@ async def compress_pdf_endpoint(file: UploadFile = File(...)):
     
     finally:
         # Cleanup temporary files
-        if temp_input and os.path.exists(temp_input):
+        if temp_input:
             try:
                 shutil.rmtree(os.path.dirname(temp_input), ignore_errors=True)
             except:
@@ -366,27 +1959,39 @@ async def compress_multiple_pdfs(files: list[UploadFile] = File(...)):
     results = []
     total_original = 0
     total_compressed = 0
+    overloaded = None
     
     try:
         for file in files:
+            # Once one file is turned away, so are the rest of the batch
+            if overloaded:
+                results.append({
+                    "original_filename": file.filename,
+                    "status": "error",
+                    "message": str(overloaded)
+                })
+                continue
+            
             temp_input = None
             try:
                 # Create temporary input file
-                temp_dir = tempfile.mkdtemp()
+                temp_dir = scratch_dir(file.size or MAX_UPLOAD_BYTES)
                 temp_input = os.path.join(temp_dir, file.filename)
                 
-                # Save uploaded file
-                file_content = await file.read()
-                with open(temp_input, 'wb') as f:
-                    f.write(file_content)
+                # Stream uploaded file to disk
+                await save_upload(file, temp_input)
+                cost = await asyncio.to_thread(estimate_cost, temp_input)
                 
                 # Create output filename
                 unique_id = str(uuid.uuid4())
                 output_filename = f"{unique_id}.pdf"
-                output_file = DOWNLOAD_FOLDER / output_filename
                 
-                # Compress the PDF
-                original_size, compressed_size = compress_pdf(str(temp_input), str(output_file))
+                # Compress the PDF (or reuse the result for an identical upload)
+                output_filename, original_size, compressed_size, report = await run_in_pool(
+                    compress_to_downloads, str(temp_input), output_filename, None, None, REQUEST_DEADLINE,
+                    cost=cost
+                )
+                record_compression(original_size, compressed_size, report)
                 
                 total_original += original_size
                 total_compressed += compressed_size
@@ -404,10 +2009,15 @@ async def compress_multiple_pdfs(files: list[UploadFile] = File(...)):
                     "download_link": download_link,
                     "original_size": format_size(original_size),
                     "compressed_size": format_size(compressed_size),
-                    "reduction_percentage": f"{reduction:.1f}%"
+                    "reduction_percentage": f"{reduction:.1f}%",
+                    "report": report
                 })
                 
             except Exception as e:
+                if isinstance(e, Overloaded):
+                    overloaded = e
+                elif not isinstance(e, UploadError):
+                    COMPRESS_FAILURES.inc(source="compress-pdf")
                 results.append({
                     "original_filename": file.filename,
                     "status": "error",
@@ -415,7 +2025,7 @@ async def compress_multiple_pdfs(files: list[UploadFile] = File(...)):
                 })
             
             finally:
-                if temp_input and os.path.exists(temp_input):
+                if temp_input:
                     try:
                         shutil.rmtree(os.path.dirname(temp_input), ignore_errors=True)
                     except:
@@ -425,6 +2035,17 @@ async def compress_multiple_pdfs(files: list[UploadFile] = File(...)):
         if total_original > 0 and total_compressed < total_original:
             total_reduction = ((total_original - total_compressed) / total_original) * 100
         
+        if overloaded and not any("download_link" in result for result in results):
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(overloaded.retry_after)},
+                content={
+                    "status": "error",
+                    "message": str(overloaded),
+                    "files": results
+                }
+            )
+        
         return JSONResponse(
             status_code=200,
             content={
@@ -447,6 +2068,106 @@ async def compress_multiple_pdfs(files: list[UploadFile] = File(...)):
         )
 
 
+@app.post("/jobs")
+async def submit_compress_job(file: UploadFile = File(...)):
+
+    if not file.filename.lower().endswith('.pdf'):
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": "Only PDF files are allowed"
+            }
+        )
+    
+    job_id = str(uuid.uuid4())
+    input_path = JOBS_FOLDER / f"{job_id}.pdf"
+    
+    try:
+        await save_upload(file, input_path)
+        
+        create_job(job_id, file.filename, str(input_path), f"{job_id}.pdf")
+        submit_job(job_id)
+        
+    except UploadError as e:
+        return JSONResponse(
+            status_code=e.status_code,
+            content={
+                "status": "error",
+                "message": str(e)
+            }
+        )
+    
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={
+                "status": "error",
+                "message": f"Error queuing PDF: {str(e)}"
+            }
+        )
+    
+    return JSONResponse(
+        status_code=202,
+        content={
+            "status": "success",
+            "message": "PDF queued for compression",
+            "job_id": job_id,
+            "status_url": f"http://127.0.0.1:8000/jobs/{job_id}"
+        }
+    )
+
+
+@app.get("/jobs/{job_id}")
+async def get_compress_job(job_id: str):
+
+    job = get_job(job_id)
+    if job is None:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "status": "error",
+                "message": "Job not found"
+            }
+        )
+    
+    content = {
+        "status": "success",
+        "job_id": job_id,
+        "original_filename": job["filename"],
+        "job_status": job["status"],
+        "progress": json.loads(job["progress"]),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+    
+    if job["status"] == "done":
+        original_size = job["original_size"]
+        compressed_size = job["compressed_size"]
+        if compressed_size < original_size:
+            reduction = ((original_size - compressed_size) / original_size) * 100
+        else:
+            reduction = 0
+        
+        content["download_link"] = f"http://127.0.0.1:8000/files/{job['output_filename']}"
+        content["details"] = {
+            "original_size": format_size(original_size),
+            "compressed_size": format_size(compressed_size),
+            "reduction_percentage": f"{reduction:.1f}%"
+        }
+        content["report"] = json.loads(job["report"]) if job["report"] else None
+    elif job["status"] == "failed":
+        content["error"] = job["error"]
+    
+    return JSONResponse(status_code=200, content=content)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,306 @@
+import os
+import time
+import uuid
+import select
+import signal
+import tempfile
+import threading
+import subprocess
+
+
+# Distiller parameters matching ghostscript_command ("ebook") and
+# ghostscript_aggressive_command ("screen") in fapi.py
+PRESETS = {
+    "ebook": {
+        "settings": "ebook",
+        "params": {
+            "CompatibilityLevel": "1.5",
+            "DetectDuplicateImages": "true",
+            "CompressFonts": "true",
+            "SubsetFonts": "true",
+            "ColorImageDownsampleType": "/Bicubic",
+            "GrayImageDownsampleType": "/Bicubic",
+            "MonoImageDownsampleType": "/Bicubic",
+        },
+    },
+    "screen": {
+        "settings": "screen",
+        "params": {
+            "CompatibilityLevel": "1.4",
+            "DetectDuplicateImages": "true",
+            "CompressFonts": "true",
+            "SubsetFonts": "true",
+            "DownsampleColorImages": "true",
+            "DownsampleGrayImages": "true",
+            "DownsampleMonoImages": "true",
+            "ColorImageResolution": "100",
+            "GrayImageResolution": "100",
+            "MonoImageResolution": "100",
+        },
+    },
+}
+
+
+def ps_string(text):
+    """Quote text as a PostScript string literal."""
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
+
+
+class GhostscriptInterpreter:
+    """
+    A long-lived `gs` process reading PostScript jobs from stdin.
+
+    The pdfwrite device stays open between jobs; each job points
+    /OutputFile at its target and switches it back to a scratch file when
+    done, which is what finalizes the written PDF.
+    """
+
+    def __init__(self, permit_paths=()):
+        self.idle_output = os.path.join(
+            tempfile.gettempdir(), f"gs-engine-{uuid.uuid4().hex}.pdf"
+        )
+        cmd = [
+            "gs",
+            "-q",
+            "-dNOPAUSE",
+            "-dNOPROMPT",
+            "-sDEVICE=pdfwrite",
+            f"-sOutputFile={self.idle_output}",
+            f"--permit-file-all={self.idle_output}",
+        ]
+        for path in permit_paths:
+            cmd.append(f"--permit-file-all={os.path.join(os.path.abspath(path), '')}")
+        cmd.append("-")
+
+        self.proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        self.pid = self.proc.pid
+        self.jobs = 0
+        self._buffer = b""
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def send(self, program):
+        self.proc.stdin.write(program.encode("latin-1"))
+        self.proc.stdin.flush()
+
+    def read_reply(self, token, timeout=0):
+        """
+        Return the status word printed for token ("OK", "ERR", "PONG"), or
+        None if it has not arrived within timeout seconds.
+        """
+        marker = f"GSENGINE {token} ".encode()
+        deadline = time.monotonic() + timeout
+
+        while True:
+            index = self._buffer.find(marker)
+            if index != -1:
+                end = self._buffer.find(b"\n", index)
+                if end != -1:
+                    status = self._buffer[index + len(marker):end].decode().strip()
+                    self._buffer = self._buffer[end + 1:]
+                    return status
+
+            remaining = deadline - time.monotonic()
+            ready, _, _ = select.select([self.proc.stdout], [], [], max(remaining, 0))
+            if not ready:
+                return None
+            try:
+                chunk = os.read(self.proc.stdout.fileno(), 65536)
+            except BlockingIOError:
+                continue
+            if not chunk:
+                return None
+            # Only the tail can still contain a partial marker
+            self._buffer = (self._buffer + chunk)[-65536:]
+
+    def ping(self, timeout=5):
+        if not self.alive():
+            return False
+        token = uuid.uuid4().hex
+        try:
+            self.send(f"(\\nGSENGINE {token} PONG\\n) print flush\n")
+        except (BrokenPipeError, OSError):
+            return False
+        return self.read_reply(token, timeout) == "PONG"
+
+    def start_job(self, input_path, output_path, preset):
+        preset = PRESETS[preset]
+        params = " ".join(f"/{key} {value}" for key, value in preset["params"].items())
+        token = uuid.uuid4().hex
+
+        program = (
+            "{ "
+            f"<< /OutputFile {ps_string(output_path)} >> setpagedevice "
+            f".distillersettings /{preset['settings']} get setdistillerparams "
+            f"<< {params} >> setdistillerparams "
+            f"{ps_string(input_path)} run "
+            "} stopped "
+            f"<< /OutputFile {ps_string(self.idle_output)} >> setpagedevice "
+            f"{{ (\\nGSENGINE {token} ERR\\n) }} {{ (\\nGSENGINE {token} OK\\n) }} ifelse "
+            "print flush clear\n"
+        )
+        self.jobs += 1
+        self.send(program)
+        return token
+
+    def close(self):
+        try:
+            self.proc.stdin.write(b"quit\n")
+            self.proc.stdin.close()
+            self.proc.wait(timeout=2)
+        except Exception:
+            self.kill()
+
+        try:
+            os.remove(self.idle_output)
+        except OSError:
+            pass
+
+    def kill(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.proc.wait()
+
+
+class GhostscriptJob:
+    """
+    Handle for one job on a pooled interpreter, with the same
+    poll()/wait()/pid surface as subprocess.Popen.
+    """
+
+    def __init__(self, engine, interpreter, token):
+        self.engine = engine
+        self.interpreter = interpreter
+        self.token = token
+        self.pid = interpreter.pid
+        self.returncode = None
+
+    def _finish(self, status):
+        if status == "OK":
+            self.returncode = 0
+        else:
+            self.returncode = 1
+        self.engine.release(self.interpreter, healthy=status is not None)
+        return self.returncode
+
+    def poll(self):
+        if self.returncode is not None:
+            return self.returncode
+
+        if not self.interpreter.alive():
+            return self._finish(None)
+
+        status = self.interpreter.read_reply(self.token)
+        if status is None:
+            return None
+        return self._finish(status)
+
+    def wait(self):
+        if self.returncode is not None:
+            return self.returncode
+
+        while self.interpreter.alive():
+            status = self.interpreter.read_reply(self.token, timeout=1)
+            if status is not None:
+                return self._finish(status)
+        return self._finish(None)
+
+    def kill(self):
+        if self.returncode is None:
+            self.interpreter.kill()
+            self._finish(None)
+
+
+class GhostscriptEngine:
+    """
+    Pool of persistent Ghostscript interpreters.
+
+    Interpreters are health-checked before reuse and recycled after
+    max_jobs jobs. When all size interpreters are busy, or the job's files
+    lie outside the directories the SAFER sandbox permits, submit()
+    returns None and the caller falls back to a one-shot `gs` process.
+    """
+
+    def __init__(self, size=4, max_jobs=50, permit_paths=()):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.permit_paths = [os.path.join(os.path.abspath(path), "") for path in (tempfile.gettempdir(), *permit_paths)]
+        self._idle = []
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            with self._lock:
+                if self._idle:
+                    interpreter = self._idle.pop()
+                elif self._busy < self.size:
+                    interpreter = None
+                else:
+                    return None
+                self._busy += 1
+
+            if interpreter is None:
+                try:
+                    return GhostscriptInterpreter(self.permit_paths)
+                except Exception:
+                    with self._lock:
+                        self._busy -= 1
+                    return None
+
+            if interpreter.ping():
+                return interpreter
+
+            interpreter.kill()
+            with self._lock:
+                self._busy -= 1
+
+    def release(self, interpreter, healthy=True):
+        if healthy and interpreter.alive() and interpreter.jobs < self.max_jobs:
+            with self._lock:
+                self._busy -= 1
+                self._idle.append(interpreter)
+            return
+
+        with self._lock:
+            self._busy -= 1
+        if interpreter.alive():
+            interpreter.close()
+        else:
+            interpreter.kill()
+
+    def permits(self, path):
+        path = os.path.abspath(path)
+        return any(path.startswith(directory) for directory in self.permit_paths)
+
+    def submit(self, input_path, output_path, preset):
+        if not (self.permits(input_path) and self.permits(output_path)):
+            return None
+
+        interpreter = self._acquire()
+        if interpreter is None:
+            return None
+
+        try:
+            token = interpreter.start_job(os.path.abspath(input_path), os.path.abspath(output_path), preset)
+        except Exception:
+            self.release(interpreter, healthy=False)
+            return None
+        return GhostscriptJob(self, interpreter, token)
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for interpreter in idle:
+            interpreter.close()
@@ -0,0 +1,622 @@
+# Image recompression shared by fapi.py and dummy.py: decoding PDF image
+# XObjects, SSIM-bounded JPEG encoding, the pikepdf strategy and the
+# target-size search
+
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+import pikepdf
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Target-size mode searches these image settings, gentlest first, for the
+# best quality whose output fits under the requested size
+TARGET_DIMENSIONS = [1600, 1200, 1000, 800, 700, 600, 500, 400, 300, 200]
+TARGET_QUALITIES = [85, 75, 65, 55, 45, 35, 25, 15]
+TARGET_MAX_PASSES = 8
+
+# Typical JPEG size at each quality relative to quality 45, same pixels;
+# used to predict the next setting to try before any encoding happens
+JPEG_QUALITY_SIZE = {85: 1.9, 75: 1.45, 65: 1.25, 55: 1.1, 45: 1.0, 35: 0.87, 25: 0.72, 15: 0.55}
+
+
+# Quality-bounded encoding: with min_ssim set, compress_image_data bisects
+# the JPEG quality within SSIM_QUALITY_RANGE for the lowest one whose SSIM
+# against the resized image stays at or above min_ssim
+SSIM_QUALITY_RANGE = (10, 90)
+SSIM_MAX_PASSES = 6
+SSIM_PLANE_SIZE = 256
+SSIM_WINDOW = 7
+
+
+def _box_filter(plane, size=SSIM_WINDOW):
+    """Mean over every size x size window, via a summed-area table."""
+    table = np.pad(plane, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return (
+        table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+    ) / (size * size)
+
+
+def ssim(plane_a, plane_b):
+    """Mean structural similarity of two equally sized 8-bit luma planes."""
+    a = plane_a.astype(np.float64)
+    b = plane_b.astype(np.float64)
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    
+    mu_a = _box_filter(a)
+    mu_b = _box_filter(b)
+    var_a = _box_filter(a * a) - mu_a * mu_a
+    var_b = _box_filter(b * b) - mu_b * mu_b
+    covariance = _box_filter(a * b) - mu_a * mu_b
+    
+    numerator = (2 * mu_a * mu_b + c1) * (2 * covariance + c2)
+    denominator = (mu_a * mu_a + mu_b * mu_b + c1) * (var_a + var_b + c2)
+    return float((numerator / denominator).mean())
+
+
+def _luma_plane(img, size):
+    return np.asarray(img.convert('L').resize(size, Image.Resampling.BILINEAR))
+
+
+def encode_jpeg_ssim(img, min_ssim):
+    """
+    Encode img as JPEG at the lowest quality whose SSIM stays at or above
+    min_ssim, using at most SSIM_MAX_PASSES trial encodes on a
+    downscaled luma plane. Returns the JPEG bytes.
+    """
+    width, height = img.size
+    ratio = min(1.0, SSIM_PLANE_SIZE / max(width, height))
+    plane_size = (max(int(width * ratio), SSIM_WINDOW), max(int(height * ratio), SSIM_WINDOW))
+    reference = _luma_plane(img, plane_size)
+    
+    low, high = SSIM_QUALITY_RANGE
+    chosen = high
+    for _ in range(SSIM_MAX_PASSES):
+        if low > high:
+            break
+        quality = (low + high) // 2
+        
+        trial = io.BytesIO()
+        img.save(trial, format='JPEG', quality=quality)
+        score = ssim(reference, _luma_plane(Image.open(trial), plane_size))
+        
+        if score >= min_ssim:
+            chosen = quality
+            high = quality - 1
+        else:
+            low = quality + 1
+    
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=chosen, optimize=True)
+    return output.getvalue()
+
+
+def compress_image_data(image_bytes, quality=50, max_dimension=800, min_ssim=None):
+    try:
+        # Raw PDF samples arrive already decoded by decode_raw_image
+        if isinstance(image_bytes, Image.Image):
+            img = image_bytes
+        else:
+            img = Image.open(io.BytesIO(image_bytes))
+        
+        # libjpeg can decode straight to 1/2, 1/4 or 1/8 scale; pick the
+        # smallest one that still covers max_dimension so oversized photos
+        # are never fully decoded
+        width, height = img.size
+        drafted = False
+        if img.format == 'JPEG' and (width > max_dimension or height > max_dimension):
+            ratio = min(max_dimension / width, max_dimension / height)
+            drafted = img.draft(img.mode, (int(width * ratio), int(height * ratio))) is not None
+        
+        if img.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            if img.mode == 'RGBA':
+                background.paste(img, mask=img.split()[3])
+            else:
+                background.paste(img, mask=img.split()[1])
+            img = background
+        elif img.mode == 'P':
+            img = img.convert('RGB')
+        elif img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        
+        if width > max_dimension or height > max_dimension:
+            ratio = min(max_dimension / width, max_dimension / height)
+            new_size = (int(width * ratio), int(height * ratio))
+            # After a draft decode at most a 2x reduction is left, which
+            # bicubic handles without visible loss
+            resample = Image.Resampling.BICUBIC if drafted else Image.Resampling.LANCZOS
+            img = img.resize(new_size, resample)
+        
+        # Per-image quality needs NumPy for the SSIM check
+        if min_ssim is not None and np is not None:
+            return encode_jpeg_ssim(img, min_ssim), img.size
+        
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=quality, optimize=True)
+        
+        return output.getvalue(), img.size
+    except Exception:
+        return None, None
+
+
+def collect_images(pdf):
+    """
+    Index every image XObject used by the document's pages by object id.
+    Returns {objgen: (stream, [(xobjects, name), ...])} so an image shared by
+    many pages is listed once together with all the places that use it.
+    """
+    images = {}
+    
+    for page in pdf.pages:
+        if '/Resources' not in page:
+            continue
+        resources = page['/Resources']
+        if '/XObject' not in resources:
+            continue
+        
+        xobjects = resources['/XObject']
+        
+        for name in list(xobjects.keys()):
+            try:
+                xobj = xobjects[name]
+                if not isinstance(xobj, pikepdf.Stream):
+                    continue
+                
+                if xobj.get('/Subtype') != pikepdf.Name.Image:
+                    continue
+                
+                entry = images.setdefault(xobj.objgen, (xobj, []))
+                entry[1].append((xobjects, name))
+            except Exception:
+                continue
+    
+    return images
+
+
+# PIL modes for the PDF colour spaces decode_raw_image understands
+COLORSPACE_MODES = {
+    '/DeviceGray': 'L',
+    '/CalGray': 'L',
+    '/DeviceRGB': 'RGB',
+    '/CalRGB': 'RGB',
+    '/DeviceCMYK': 'CMYK',
+}
+
+# PIL raw unpackers for sub-byte samples, by (mode, BitsPerComponent)
+PACKED_RAWMODES = {
+    ('L', 1): ('1', '1'),
+    ('L', 2): ('L', 'L;2'),
+    ('L', 4): ('L', 'L;4'),
+    ('P', 1): ('P', 'P;1'),
+    ('P', 2): ('P', 'P;2'),
+    ('P', 4): ('P', 'P;4'),
+}
+
+
+def _colorspace_mode(colorspace):
+    """Return (PIL mode, ICC profile bytes or None) for a non-indexed colour space."""
+    if isinstance(colorspace, pikepdf.Array):
+        if len(colorspace) < 2:
+            return None, None
+        family = str(colorspace[0])
+        if family == '/ICCBased':
+            profile = colorspace[1]
+            mode = {1: 'L', 3: 'RGB', 4: 'CMYK'}.get(int(profile.get('/N', 0)))
+            return mode, profile.read_bytes()
+        return COLORSPACE_MODES.get(family), None
+    
+    return COLORSPACE_MODES.get(str(colorspace)), None
+
+
+def _apply_icc(img, profile):
+    """Convert img from its embedded ICC profile to sRGB where possible."""
+    if profile is None or img.mode == 'L':
+        return img
+    try:
+        from PIL import ImageCms
+        source = ImageCms.ImageCmsProfile(io.BytesIO(profile))
+        return ImageCms.profileToProfile(img, source, ImageCms.createProfile('sRGB'), outputMode='RGB')
+    except Exception:
+        return img
+
+
+def decode_raw_image(xobj):
+    """
+    Build a PIL image from an image XObject's decoded samples using
+    /Width, /Height, /BitsPerComponent, /ColorSpace and /Decode.
+    Predictors from /DecodeParms are undone by read_bytes(). Returns None
+    for layouts we can't reproduce faithfully (e.g. Lab, DeviceN or
+    arbitrary /Decode ranges).
+    """
+    width = int(xobj.get('/Width', 0))
+    height = int(xobj.get('/Height', 0))
+    bpc = int(xobj.get('/BitsPerComponent', 8))
+    colorspace = xobj.get('/ColorSpace')
+    
+    if xobj.get('/ImageMask', False):
+        return None
+    
+    palette = None
+    if isinstance(colorspace, pikepdf.Array) and len(colorspace) == 4 and str(colorspace[0]) == '/Indexed':
+        base_mode, profile = _colorspace_mode(colorspace[1])
+        if base_mode is None:
+            return None
+        
+        lookup = colorspace[3]
+        lookup = lookup.read_bytes() if isinstance(lookup, pikepdf.Stream) else bytes(lookup)
+        entries = int(colorspace[2]) + 1
+        base = Image.frombytes(base_mode, (entries, 1), lookup[:entries * len(base_mode)])
+        palette = _apply_icc(base, profile).convert('RGB').tobytes()
+        mode, profile = 'P', None
+    else:
+        mode, profile = _colorspace_mode(colorspace)
+        if mode is None:
+            return None
+    
+    data = xobj.read_bytes()
+    if bpc == 16:
+        # Keep the high byte of each big-endian sample
+        data = data[0::2]
+        bpc = 8
+    
+    if bpc == 8:
+        img = Image.frombytes(mode, (width, height), data)
+    elif (mode, bpc) in PACKED_RAWMODES:
+        image_mode, rawmode = PACKED_RAWMODES[(mode, bpc)]
+        img = Image.frombytes(image_mode, (width, height), data, 'raw', rawmode)
+    else:
+        return None
+    
+    decode = xobj.get('/Decode')
+    if decode is not None:
+        values = [float(v) for v in decode]
+        identity = [0.0, 1.0] * (len(values) // 2)
+        inverted = [1.0, 0.0] * (len(values) // 2)
+        if mode == 'P' or values not in (identity, inverted):
+            return None
+        if values == inverted:
+            img = ImageOps.invert(img.convert('L' if img.mode == '1' else img.mode))
+    
+    if palette is not None:
+        img.putpalette(palette)
+        return img.convert('RGB')
+    
+    if img.mode == '1':
+        img = img.convert('L')
+    
+    return _apply_icc(img, profile)
+
+
+def jpeg_bytes(xobj):
+    """
+    The JPEG file inside an image whose filter chain ends in /DCTDecode,
+    e.g. [/FlateDecode /DCTDecode], or None for other images.
+    """
+    filters = xobj.get('/Filter')
+    if filters == pikepdf.Name.DCTDecode:
+        return xobj.read_raw_bytes()
+    
+    if not isinstance(filters, pikepdf.Array) or len(filters) < 2 or filters[-1] != pikepdf.Name.DCTDecode:
+        return None
+    
+    # qpdf won't decode a chain it can't finish, so undo the outer filters
+    # on a copy that leaves /DCTDecode off (owned by a throwaway Pdf, which
+    # must stay referenced while the copy is used)
+    scratch = pikepdf.new()
+    outer = pikepdf.Stream(scratch, xobj.read_raw_bytes())
+    outer['/Filter'] = pikepdf.Array(list(filters)[:-1])
+    parms = xobj.get('/DecodeParms')
+    if isinstance(parms, pikepdf.Array):
+        outer['/DecodeParms'] = pikepdf.Array(list(parms)[:-1])
+    try:
+        return outer.read_bytes()
+    except pikepdf.PdfError:
+        return None
+
+
+def extract_image(xobj):
+    """
+    Return (image_data, raw_size) for an image worth recompressing, or
+    None. image_data is the JPEG file for images with /DCTDecode last in
+    their filter chain and a decoded PIL image for everything else.
+    """
+    width = int(xobj.get('/Width', 0))
+    height = int(xobj.get('/Height', 0))
+    
+    if width < 50 or height < 50:
+        return None
+    
+    # Colour-key masks refer to the original sample values
+    if isinstance(xobj.get('/Mask'), pikepdf.Array):
+        return None
+    
+    raw_size = len(xobj.read_raw_bytes())
+    
+    image_data = jpeg_bytes(xobj)
+    if image_data is None:
+        image_data = decode_raw_image(xobj)
+        if image_data is None:
+            return None
+    
+    return image_data, raw_size
+
+
+def _compress_image_job(args):
+    image_data, quality, max_dimension, min_ssim = args
+    return compress_image_data(image_data, quality=quality, max_dimension=max_dimension, min_ssim=min_ssim)
+
+
+def compress_images(payloads, quality=50, max_dimension=800, workers=1, pool=None, min_ssim=None):
+    """
+    Run compress_image_data over a list of image payloads, fanned out to
+    a process pool when workers > 1 (or on pool, if given). Results come
+    back in input order.
+    """
+    jobs = [(image_data, quality, max_dimension, min_ssim) for image_data in payloads]
+    
+    if pool is not None:
+        return list(pool.map(_compress_image_job, jobs))
+    
+    if workers <= 1 or len(jobs) < 2:
+        return [_compress_image_job(job) for job in jobs]
+    
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(_compress_image_job, jobs))
+
+
+def build_image_stream(pdf, compressed_data, new_size, original=None):
+    mode = Image.open(io.BytesIO(compressed_data)).mode
+    
+    new_stream = pikepdf.Stream(pdf, compressed_data)
+    new_stream['/Type'] = pikepdf.Name.XObject
+    new_stream['/Subtype'] = pikepdf.Name.Image
+    new_stream['/Width'] = new_size[0]
+    new_stream['/Height'] = new_size[1]
+    if mode == 'L':
+        new_stream['/ColorSpace'] = pikepdf.Name.DeviceGray
+    else:
+        new_stream['/ColorSpace'] = pikepdf.Name.DeviceRGB
+    new_stream['/BitsPerComponent'] = 8
+    new_stream['/Filter'] = pikepdf.Name.DCTDecode
+    
+    # Soft masks and stencil masks carry their own dimensions, so they stay
+    # valid for the resized image
+    if original is not None:
+        if '/SMask' in original:
+            new_stream['/SMask'] = original['/SMask']
+        if isinstance(original.get('/Mask'), pikepdf.Stream):
+            new_stream['/Mask'] = original['/Mask']
+    
+    return pdf.make_indirect(new_stream)
+
+
+def compress_with_pikepdf(input_path, output_path, quality=50, max_dimension=800, workers=1,
+                          min_ssim=None):
+    """Compress using pikepdf with image recompression"""
+    try:
+        pdf = pikepdf.open(input_path, access_mode=pikepdf.AccessMode.mmap)
+        images_processed = 0
+        images = list(collect_images(pdf).values())
+        
+        # Images go through in batches of one per worker, so no more than
+        # that many decoded images are alive at once however many the
+        # document holds
+        batch_size = max(workers, 1)
+        pool = None
+        if workers > 1 and len(images) > 1:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(images)))
+        
+        try:
+            for start in range(0, len(images), batch_size):
+                # Each unique image is read once in this process...
+                pending = []
+                for xobj, references in images[start:start + batch_size]:
+                    try:
+                        extracted = extract_image(xobj)
+                    except Exception:
+                        continue
+                    if extracted is not None:
+                        pending.append((xobj, references, *extracted))
+                
+                # ...decoded, resized and re-encoded on the worker pool...
+                compressed = compress_images(
+                    [image_data for xobj, references, image_data, raw_size in pending],
+                    quality=quality,
+                    max_dimension=max_dimension,
+                    pool=pool,
+                    min_ssim=min_ssim
+                )
+                
+                # ...and every page that uses it is pointed at one replacement stream
+                for (xobj, references, image_data, raw_size), (compressed_data, new_size) in zip(pending, compressed):
+                    if not compressed_data or len(compressed_data) >= raw_size * 0.9:
+                        continue
+                    
+                    new_stream = build_image_stream(pdf, compressed_data, new_size, original=xobj)
+                    for xobjects, name in references:
+                        xobjects[name] = new_stream
+                    images_processed += 1
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        
+        pdf.save(
+            output_path,
+            compress_streams=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            recompress_flate=True
+        )
+        pdf.close()
+        return True
+    except Exception:
+        return False
+
+
+#  Target-size search
+
+def decode_for_search(xobj):
+    """
+    Decode an image once for the target-size search, already shrunk to
+    the largest dimension the search can ask for. Returns
+    (PIL image, raw_size) or None.
+    """
+    extracted = extract_image(xobj)
+    if extracted is None:
+        return None
+    
+    image_data, raw_size = extracted
+    largest = TARGET_DIMENSIONS[0]
+    
+    if isinstance(image_data, Image.Image):
+        img = image_data
+    else:
+        img = Image.open(io.BytesIO(image_data))
+        img.draft(img.mode, (largest, largest))
+    
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img.thumbnail((largest, largest), Image.Resampling.LANCZOS)
+    return img, raw_size
+
+
+def _scaled_pixels(img, max_dimension):
+    width, height = img.size
+    ratio = min(1.0, max_dimension / max(width, height))
+    return width * height * ratio * ratio
+
+
+def search_target_size(input_path, output_path, target_bytes, info, workers=1, deadline=None):
+    """
+    Re-encode the document's images at the best quality/resolution whose
+    output fits in target_bytes and save it to output_path. Images are
+    decoded once; every pass only resizes and re-encodes. Each pass picks
+    the gentlest setting predicted to fit, from a size model calibrated on
+    the passes before it. Once deadline (a time.monotonic() value) passes,
+    no further pass starts and the smallest result so far is kept, with
+    info["cut_off"] set. Returns the saved size, or None if the document
+    has no images to work with or no pass finished in time. Search details
+    are written into info.
+    """
+    with pikepdf.open(input_path, access_mode=pikepdf.AccessMode.mmap) as pdf:
+        images = []
+        for xobj, references in collect_images(pdf).values():
+            try:
+                decoded = decode_for_search(xobj)
+            except Exception:
+                continue
+            if decoded is not None:
+                images.append((xobj, references, *decoded))
+        
+        if not images:
+            return None
+        
+        # Everything that is not an image stays as it is, so measure it once
+        buffer = io.BytesIO()
+        pdf.save(buffer, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        base_size = len(buffer.getvalue()) - sum(raw_size for _, _, _, raw_size in images)
+        budget = target_bytes - base_size
+        
+        settings = [(quality, dimension) for dimension in TARGET_DIMENSIONS for quality in TARGET_QUALITIES]
+        probe = None
+        correction = 1.0
+        tried = set()
+        best = None
+        written = None
+        
+        def predict(quality, dimension):
+            if probe is None:
+                return 0
+            probe_quality, probe_dimension, probe_sizes = probe
+            total = 0
+            for (_, _, img, raw_size), probe_size in zip(images, probe_sizes):
+                scale = _scaled_pixels(img, dimension) / max(_scaled_pixels(img, probe_dimension), 1)
+                quality_scale = JPEG_QUALITY_SIZE[quality] / JPEG_QUALITY_SIZE[probe_quality]
+                total += min(probe_size * scale * quality_scale, raw_size)
+            return total * correction
+        
+        def write(encoded):
+            for (xobj, references, img, raw_size), (compressed_data, new_size) in zip(images, encoded):
+                if compressed_data and len(compressed_data) < raw_size:
+                    replacement = build_image_stream(pdf, compressed_data, new_size, original=xobj)
+                else:
+                    replacement = xobj
+                for xobjects, name in references:
+                    xobjects[name] = replacement
+            
+            pdf.save(
+                output_path,
+                compress_streams=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate
+            )
+            nonlocal written
+            written = (encoded, os.path.getsize(output_path))
+            return written[1]
+        
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(images) > 1 else None
+        try:
+            for passes in range(1, TARGET_MAX_PASSES + 1):
+                if deadline is not None and time.monotonic() >= deadline:
+                    info["cut_off"] = True
+                    break
+                
+                untried = [s for s in settings if s not in tried]
+                if not untried:
+                    break
+                
+                if probe is None:
+                    # Start from the pikepdf strategy's usual setting
+                    quality, dimension = 45, 700
+                else:
+                    fitting = [s for s in untried if predict(*s) <= budget]
+                    if fitting:
+                        quality, dimension = max(fitting, key=lambda s: predict(*s))
+                    else:
+                        quality, dimension = min(untried, key=lambda s: predict(*s))
+                
+                predicted = predict(quality, dimension)
+                encoded = compress_images(
+                    [img for _, _, img, _ in images], quality, dimension, pool=pool
+                )
+                tried.add((quality, dimension))
+                
+                sizes = [
+                    len(data) if data else raw_size
+                    for (data, _), (_, _, _, raw_size) in zip(encoded, images)
+                ]
+                actual = sum(min(size, raw_size) for size, (_, _, _, raw_size) in zip(sizes, images))
+                
+                if probe is None:
+                    probe = (quality, dimension, sizes)
+                elif predicted:
+                    correction *= actual / predicted
+                
+                info.update({"passes": passes, "quality": quality, "max_dimension": dimension})
+                
+                if best is None or actual < best[0]:
+                    best = (actual, quality, dimension, encoded)
+                
+                if actual <= budget:
+                    saved_size = write(encoded)
+                    if saved_size <= target_bytes:
+                        return saved_size
+                    # The non-image estimate was off; tighten the budget by the miss
+                    budget -= saved_size - target_bytes
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        
+        if best is None:
+            return None
+        
+        actual, quality, dimension, encoded = best
+        info.update({"quality": quality, "max_dimension": dimension})
+        if written is not None and written[0] is encoded:
+            return written[1]
+        return write(encoded)
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batch import get_non_overwriting_path
+
+
+class GetNonOverwritingPathTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.folder = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def touch(self, name):
+        (self.folder / name).write_bytes(b"%PDF")
+
+    def test_free_name_is_claimed_as_is(self):
+        path = get_non_overwriting_path(self.folder / "compressed_scan.pdf")
+        self.assertEqual(path, self.folder / "compressed_scan.pdf")
+        self.assertTrue(path.exists())
+
+    def test_stem_ending_in_digits_is_not_a_suffix(self):
+        self.touch("compressed_scan_20240115.pdf")
+        path = get_non_overwriting_path(self.folder / "compressed_scan.pdf")
+        self.assertEqual(path, self.folder / "compressed_scan.pdf")
+
+    def test_name_ending_in_digits_gets_its_own_suffix(self):
+        self.touch("compressed_scan_20240115.pdf")
+        path = get_non_overwriting_path(self.folder / "compressed_scan_20240115.pdf")
+        self.assertEqual(path, self.folder / "compressed_scan_20240115_1.pdf")
+
+    def test_taken_name_skips_past_existing_suffixes(self):
+        for name in ("compressed_a.pdf", "compressed_a_1.pdf", "compressed_a_2.pdf"):
+            self.touch(name)
+        first = get_non_overwriting_path(self.folder / "compressed_a.pdf")
+        second = get_non_overwriting_path(self.folder / "compressed_a.pdf")
+        self.assertEqual(first, self.folder / "compressed_a_3.pdf")
+        self.assertEqual(second, self.folder / "compressed_a_4.pdf")
+
+    def test_reserved_names_are_skipped(self):
+        reserved = {self.folder / "compressed_a.pdf"}
+        path = get_non_overwriting_path(self.folder / "compressed_a.pdf", reserved)
+        self.assertEqual(path, self.folder / "compressed_a_1.pdf")
+        self.assertIn(path, reserved)
+
+
+if __name__ == "__main__":
+    unittest.main()
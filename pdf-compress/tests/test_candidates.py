@@ -0,0 +1,135 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pikepdf
+from PIL import Image
+
+import fapi
+from gs_engine import GhostscriptEngine
+
+
+# One-shot commands the engine presets are meant to reproduce
+PRESET_COMMANDS = {
+    "ebook": lambda input_path, output_path: fapi.ghostscript_command(input_path, output_path, "ebook"),
+    "screen": fapi.ghostscript_aggressive_command,
+}
+
+
+def make_pdf(path, pages=2):
+    """A small PDF of noisy RGB pages, so every preset has images to resample."""
+    images = [Image.effect_noise((600, 800), 64).convert("RGB") for _ in range(pages)]
+    images[0].save(path, "PDF", resolution=150, save_all=True, append_images=images[1:])
+
+
+def python_command(code):
+    return [sys.executable, "-c", code]
+
+
+class CandidateFallbackTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.temp_dir, "out.pdf")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_returncode_has_no_side_effects(self):
+        proc = fapi.spawn_ghostscript(python_command("raise SystemExit(1)"))
+        proc.wait()
+        candidate = fapi.Candidate("gs", self.output_path, proc, fallback=python_command("pass"))
+        self.assertEqual(candidate.returncode, 1)
+        self.assertIs(candidate.proc, proc)
+        self.assertIsNotNone(candidate.fallback)
+
+    def test_failed_job_recovers_through_fallback(self):
+        proc = fapi.spawn_ghostscript(python_command("raise SystemExit(1)"))
+        proc.wait()
+        fallback = python_command(f"open({self.output_path!r}, 'wb').write(b'%PDF-1.4')")
+        candidate = fapi.Candidate("gs", self.output_path, proc, timeout=60, fallback=fallback)
+        # Without a fresh start the fallback would count as timed out at once
+        candidate.started -= 120
+
+        results = fapi.collect_candidates([candidate])
+
+        self.assertEqual(results, [("gs", self.output_path, 8)])
+        self.assertIsNone(candidate.fallback)
+        self.assertFalse(candidate.timed_out())
+
+    def test_fallback_runs_once(self):
+        proc = fapi.spawn_ghostscript(python_command("raise SystemExit(1)"))
+        states = []
+        candidate = fapi.Candidate(
+            "gs", self.output_path, proc, fallback=python_command("raise SystemExit(1)")
+        )
+
+        results = fapi.collect_candidates([candidate], progress=lambda name, state: states.append(state))
+
+        self.assertEqual(results, [])
+        self.assertEqual(states, ["failed"])
+
+
+@unittest.skipUnless(shutil.which("gs"), "Ghostscript is not installed")
+class GhostscriptEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.temp_dir, "input.pdf")
+        make_pdf(self.input_path)
+        self.engine = GhostscriptEngine(size=1)
+
+    def tearDown(self):
+        self.engine.shutdown()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_presets_match_one_shot_commands(self):
+        for preset, command in PRESET_COMMANDS.items():
+            with self.subTest(preset=preset):
+                engine_output = os.path.join(self.temp_dir, f"engine_{preset}.pdf")
+                oneshot_output = os.path.join(self.temp_dir, f"oneshot_{preset}.pdf")
+
+                job = self.engine.submit(self.input_path, engine_output, preset)
+                self.assertIsNotNone(job)
+                self.assertEqual(job.wait(), 0)
+                proc = fapi.spawn_ghostscript(command(self.input_path, oneshot_output))
+                self.assertEqual(proc.wait(), 0)
+
+                with pikepdf.open(engine_output) as engine_pdf, pikepdf.open(oneshot_output) as oneshot_pdf:
+                    self.assertEqual(engine_pdf.pdf_version, oneshot_pdf.pdf_version)
+                    self.assertEqual(len(engine_pdf.pages), len(oneshot_pdf.pages))
+                    for engine_page, oneshot_page in zip(engine_pdf.pages, oneshot_pdf.pages):
+                        self.assertEqual(list(engine_page.mediabox), list(oneshot_page.mediabox))
+                        engine_images = [image.width for image in engine_page.images.values()]
+                        oneshot_images = [image.width for image in oneshot_page.images.values()]
+                        self.assertEqual(engine_images, oneshot_images)
+
+                # Only dates and document IDs may differ
+                engine_size = os.path.getsize(engine_output)
+                oneshot_size = os.path.getsize(oneshot_output)
+                self.assertLess(abs(engine_size - oneshot_size), oneshot_size * 0.02)
+
+    def test_err_job_recovers_through_fallback(self):
+        output_path = os.path.join(self.temp_dir, "out.pdf")
+        # The interpreter reports ERR for an input it cannot open
+        missing_path = os.path.join(self.temp_dir, "missing.pdf")
+
+        job = self.engine.submit(missing_path, output_path, "ebook")
+        self.assertIsNotNone(job)
+        candidate = fapi.Candidate(
+            "ghostscript_ebook", output_path, job,
+            timeout=fapi.GS_TIMEOUT, fallback=fapi.ghostscript_command(self.input_path, output_path)
+        )
+
+        results = fapi.collect_candidates([candidate])
+
+        self.assertEqual(job.returncode, 1)
+        self.assertEqual([name for name, _, _ in results], ["ghostscript_ebook"])
+        with pikepdf.open(output_path) as pdf:
+            self.assertEqual(len(pdf.pages), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()